@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Manifest-based delta uploads for pipeline artifacts.
+
+Each artifact directory (output/, results/) carries a manifest.json listing
+the SHA-256 and size of every file in it. A sync compares the local manifest
+with the one stored at the destination, transfers only new or changed files
+in parallel, verifies each upload by hash and writes the destination manifest
+last, so an interrupted sync is simply resumed by the next run.
+
+Destinations are a local directory (also handy for testing) or an S3
+bucket such as Hetzner Object Storage, which needs boto3. S3 uploads carry a
+SHA-256 checksum that the store validates and reports back; stores without
+checksum support are verified by hashing the stored object.
+
+Usage:
+    python3 artifact_sync.py manifest --root output
+    python3 artifact_sync.py push --root output --dest /mnt/backup/output
+    python3 artifact_sync.py push --root output --include contracts.json --s3-bucket my-bucket --endpoint-url http://5.161.70.165:9000
+    python3 artifact_sync.py changed --root output --remote-manifest remote_manifest.json
+"""
+
+import argparse
+import base64
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+MANIFEST_NAME = "manifest.json"
+EXCLUDE_PATTERNS = ("*.tmp", "*.db", "*.db-journal", MANIFEST_NAME)
+HASH_CHUNK = 1024 * 1024
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_manifest(path):
+    """Load a manifest file, treating a missing one as empty."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return {"files": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def build_manifest(root, previous=None):
+    """Hash every artifact under root, reusing hashes of files whose size and mtime are unchanged."""
+    previous_files = (previous or {}).get("files", {})
+    files = {}
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if any(fnmatch.fnmatch(filename, pattern) for pattern in EXCLUDE_PATTERNS):
+                continue
+            path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(path, root).replace(os.sep, "/")
+            stat = os.stat(path)
+            known = previous_files.get(relpath)
+            if known and known["size"] == stat.st_size and known.get("mtime") == stat.st_mtime:
+                files[relpath] = known
+                continue
+            files[relpath] = {"sha256": file_sha256(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    return {"generated_at": datetime.now().isoformat(), "files": files}
+
+def write_manifest(root):
+    """Refresh root/manifest.json and return it."""
+    path = os.path.join(root, MANIFEST_NAME)
+    manifest = build_manifest(root, read_manifest(path))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return manifest
+
+def select_files(manifest, include):
+    """Restrict a manifest to the paths matching any of the include patterns."""
+    if not include:
+        return manifest
+    files = {
+        relpath: entry for relpath, entry in manifest["files"].items()
+        if any(fnmatch.fnmatch(relpath, pattern) for pattern in include)
+    }
+    return {**manifest, "files": files}
+
+def changed_files(local, remote):
+    """List the paths whose content differs from the destination manifest."""
+    remote_files = remote.get("files", {})
+    return [
+        relpath for relpath, entry in sorted(local["files"].items())
+        if remote_files.get(relpath, {}).get("sha256") != entry["sha256"]
+    ]
+
+class DirectoryTarget:
+    """Sync destination on a local or mounted filesystem."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def read_manifest(self):
+        return read_manifest(os.path.join(self.path, MANIFEST_NAME))
+
+    def upload(self, local_path, relpath, entry):
+        dest = os.path.join(self.path, relpath)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp_path = f"{dest}.tmp"
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, dest)
+
+    def verify(self, relpath, entry):
+        return file_sha256(os.path.join(self.path, relpath)) == entry["sha256"]
+
+    def write_manifest(self, manifest):
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, MANIFEST_NAME)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+class S3Target:
+    """Sync destination in an S3-compatible bucket, sharing one pooled client across uploads."""
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, profile=None, workers=8, region=None):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("boto3 is required for S3 uploads: pip install boto3") from e
+
+        session = boto3.Session(profile_name=profile)
+        self.client = session.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(max_pool_connections=workers, retries={"max_attempts": 5})
+        )
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, relpath):
+        return f"{self.prefix}/{relpath}" if self.prefix else relpath
+
+    def read_manifest(self):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(MANIFEST_NAME))
+        except self.client.exceptions.NoSuchKey:
+            return {"files": {}}
+        return json.loads(response["Body"].read())
+
+    def upload(self, local_path, relpath, entry):
+        self.client.upload_file(
+            local_path, self.bucket, self._key(relpath),
+            ExtraArgs={
+                "Metadata": {"sha256": entry["sha256"]},
+                "CacheControl": "max-age=86400",
+                # The store checks the content against this checksum and keeps it
+                "ChecksumAlgorithm": "SHA256"
+            }
+        )
+
+    def verify(self, relpath, entry):
+        key = self._key(relpath)
+        head = self.client.head_object(Bucket=self.bucket, Key=key, ChecksumMode="ENABLED")
+        if head["ContentLength"] != entry["size"]:
+            return False
+        checksum = head.get("ChecksumSHA256")
+        if checksum and "-" not in checksum:
+            return base64.b64decode(checksum).hex() == entry["sha256"]
+
+        # Multipart uploads only have a checksum of part checksums, and some
+        # stores keep none, so hash the stored bytes instead
+        body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: body.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+        return digest.hexdigest() == entry["sha256"]
+
+    def write_manifest(self, manifest):
+        self.client.put_object(
+            Bucket=self.bucket, Key=self._key(MANIFEST_NAME),
+            Body=json.dumps(manifest, indent=2).encode(), ContentType="application/json"
+        )
+
+def push(root, target, workers=8, include=None):
+    """Upload the files that changed since the last sync and return their paths.
+
+    include limits the upload to paths matching those patterns.
+    """
+    local = select_files(write_manifest(root), include)
+    remote = target.read_manifest()
+    pending = changed_files(local, remote)
+    print(f"{len(pending)} of {len(local['files'])} files changed since the last sync")
+
+    def transfer(relpath):
+        entry = local["files"][relpath]
+        target.upload(os.path.join(root, relpath), relpath, entry)
+        if not target.verify(relpath, entry):
+            raise RuntimeError(f"Hash mismatch after uploading {relpath}")
+        return relpath
+
+    synced = dict(remote.get("files", {}))
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {relpath: pool.submit(transfer, relpath) for relpath in pending}
+        for relpath, future in futures.items():
+            try:
+                future.result()
+                synced[relpath] = local["files"][relpath]
+            except Exception as e:
+                failures.append(relpath)
+                print(f"Error uploading {relpath}: {e}")
+
+    # Record what actually reached the destination, so failures are retried next time
+    target.write_manifest({"generated_at": local["generated_at"], "files": synced})
+    if failures:
+        raise RuntimeError(f"{len(failures)} files failed to upload")
+    print(f"Uploaded and verified {len(pending)} files")
+    return pending
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Content-hash manifests and delta uploads for pipeline artifacts")
+    parser.add_argument("command", choices=["manifest", "changed", "push"])
+    parser.add_argument("--root", default="output", help="Artifact directory (default: %(default)s)")
+    parser.add_argument("--remote-manifest", help="Destination manifest to diff against (changed)")
+    parser.add_argument("--dest", help="Destination directory (push)")
+    parser.add_argument("--s3-bucket", help="Destination bucket (push)")
+    parser.add_argument("--s3-prefix", default="", help="Key prefix inside the bucket")
+    parser.add_argument("--endpoint-url", help="S3 endpoint, e.g. Hetzner Object Storage")
+    parser.add_argument("--profile", help="AWS credentials profile")
+    parser.add_argument("--region", help="S3 region name")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel transfers (default: %(default)s)")
+    parser.add_argument("--include", action="append", default=[],
+                        help="Only sync paths matching this pattern, e.g. contracts.json; repeatable")
+    args = parser.parse_args()
+
+    if args.command == "manifest":
+        manifest = write_manifest(args.root)
+        print(f"Wrote manifest of {len(manifest['files'])} files to {os.path.join(args.root, MANIFEST_NAME)}")
+    elif args.command == "changed":
+        # One path per line, suitable for `rclone copy --files-from`
+        local = select_files(write_manifest(args.root), args.include)
+        remote = read_manifest(args.remote_manifest) if args.remote_manifest else {"files": {}}
+        for relpath in changed_files(local, remote):
+            print(relpath)
+    else:
+        if args.s3_bucket:
+            target = S3Target(args.s3_bucket, args.s3_prefix, args.endpoint_url, args.profile, args.workers, args.region)
+        elif args.dest:
+            target = DirectoryTarget(args.dest)
+        else:
+            parser.error("push needs --dest or --s3-bucket")
+        push(args.root, target, args.workers, args.include)
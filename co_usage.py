@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Wallet x contract co-usage analytics.
+
+Ingested records are turned into a sparse wallet x contract incidence matrix
+A (CSR, one entry per distinct wallet/contract pair) and the contract x
+contract co-usage matrix C = A^T A, whose entry (i, j) is the number of
+wallets that used both contracts and whose diagonal is each contract's
+wallet count. Jaccard overlap follows as C_ij / (C_ii + C_jj - C_ij).
+
+C is maintained incrementally, one day at a time. Only the day's novel
+pairs N (those not seen before) change it, and only incidence rows for the
+wallets in N are involved:
+
+    C += N^T A_w + A_w^T N + N^T N
+
+Stored pairs are kept sorted by wallet, so those rows are found by binary
+search and the matrix update scales with the day's activity rather than the
+whole history. Recording the novel pairs still merges them into the sorted
+arrays, one linear copy of the stored pairs per day (as is saving the
+state). Novel pairs are processed in chunks of at most CHUNK_PAIRS so
+temporaries stay within a fixed budget. Re-feeding records that were
+already ingested changes nothing.
+
+Snapshot publishes in process_contracts.py update the state and
+results/co_usage.json when numpy and scipy are installed.
+
+Wallets are keyed by the first 8 bytes of their address, and interacting
+wallets are capped at 100 per record by the Substreams module.
+
+Requires numpy and scipy.
+
+Usage:
+    python3 co_usage.py output/contracts.json
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import scipy.sparse as sp
+
+STATE_PATH = "output/co_usage/state.npz"
+RESULTS_PATH = "results/co_usage.json"
+CHUNK_PAIRS = 2_000_000
+TOP_PAIRS = 200
+
+def wallet_key(wallet):
+    """Map a wallet address to a uint64 key, or None if it is not an address."""
+    if not isinstance(wallet, str) or len(wallet) != 42 or not wallet.startswith("0x"):
+        return None
+    try:
+        return int(wallet[2:18], 16)
+    except ValueError:
+        return None
+
+def _unique_pairs(wallets, contracts):
+    """Sort pairs by wallet and drop duplicates."""
+    if len(wallets) == 0:
+        return wallets, contracts
+    order = np.lexsort((contracts, wallets))
+    wallets, contracts = wallets[order], contracts[order]
+    keep = np.ones(len(wallets), dtype=bool)
+    keep[1:] = (wallets[1:] != wallets[:-1]) | (contracts[1:] != contracts[:-1])
+    return wallets[keep], contracts[keep]
+
+class CoUsage:
+    """Incidence pairs and co-usage matrix, persisted between runs."""
+
+    def __init__(self):
+        self.contracts = []
+        self.contract_index = {}
+        self.pair_wallets = np.empty(0, dtype=np.uint64)
+        self.pair_contracts = np.empty(0, dtype=np.int32)
+        self.matrix = sp.csr_matrix((0, 0), dtype=np.int64)
+
+    @classmethod
+    def load(cls, path=STATE_PATH):
+        state = cls()
+        if not os.path.exists(path):
+            return state
+        with np.load(path) as data:
+            state.contracts = [str(address) for address in data["contracts"]]
+            state.contract_index = {address: index for index, address in enumerate(state.contracts)}
+            state.pair_wallets = data["pair_wallets"]
+            state.pair_contracts = data["pair_contracts"]
+            size = len(state.contracts)
+            state.matrix = sp.csr_matrix(
+                (data["matrix_data"], data["matrix_indices"], data["matrix_indptr"]), shape=(size, size)
+            )
+        return state
+
+    def save(self, path=STATE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            contracts=np.array(self.contracts, dtype=str),
+            pair_wallets=self.pair_wallets,
+            pair_contracts=self.pair_contracts,
+            matrix_data=self.matrix.data,
+            matrix_indices=self.matrix.indices,
+            matrix_indptr=self.matrix.indptr
+        )
+        os.replace(tmp_path, path)
+
+    def _contract_id(self, address):
+        address = address.lower()
+        index = self.contract_index.get(address)
+        if index is None:
+            index = len(self.contracts)
+            self.contract_index[address] = index
+            self.contracts.append(address)
+        return index
+
+    def _resize(self):
+        size = len(self.contracts)
+        if self.matrix.shape != (size, size):
+            coo = self.matrix.tocoo()
+            self.matrix = sp.csr_matrix((coo.data, (coo.row, coo.col)), shape=(size, size), dtype=np.int64)
+
+    def add_day(self, records):
+        """Fold one day's records into the incidence pairs and co-usage matrix."""
+        wallets = []
+        contracts = []
+        for record in records:
+            keys = [key for key in map(wallet_key, record.get("interacting_wallets") or []) if key is not None]
+            if not keys:
+                continue
+            contract = self._contract_id(record["address"])
+            wallets.extend(keys)
+            contracts.extend([contract] * len(keys))
+        self._resize()
+        if not wallets:
+            return 0
+
+        new_wallets, new_contracts = _unique_pairs(
+            np.array(wallets, dtype=np.uint64), np.array(contracts, dtype=np.int32)
+        )
+
+        # Incidence rows already stored for today's wallets
+        related = self._rows_for(np.unique(new_wallets))
+        old_wallets, old_contracts = self.pair_wallets[related], self.pair_contracts[related]
+
+        # Keep only pairs not seen on earlier days; the old copy sorts first within each pair
+        all_wallets = np.concatenate([old_wallets, new_wallets])
+        all_contracts = np.concatenate([old_contracts, new_contracts])
+        is_new = np.concatenate([np.zeros(len(old_wallets), bool), np.ones(len(new_wallets), bool)])
+        order = np.lexsort((is_new, all_contracts, all_wallets))
+        all_wallets, all_contracts, is_new = all_wallets[order], all_contracts[order], is_new[order]
+        seen = np.zeros(len(all_wallets), dtype=bool)
+        seen[1:] = (all_wallets[1:] == all_wallets[:-1]) & (all_contracts[1:] == all_contracts[:-1])
+        novel = is_new & ~seen
+        novel_wallets, novel_contracts = all_wallets[novel], all_contracts[novel]
+
+        # Chunk on wallet boundaries so each wallet's pairs stay together
+        start = 0
+        while start < len(novel_wallets):
+            stop = min(start + CHUNK_PAIRS, len(novel_wallets))
+            while stop < len(novel_wallets) and novel_wallets[stop] == novel_wallets[stop - 1]:
+                stop += 1
+            chunk_wallets = novel_wallets[start:stop]
+            lo = np.searchsorted(old_wallets, chunk_wallets[0], "left")
+            hi = np.searchsorted(old_wallets, chunk_wallets[-1], "right")
+            self._apply(chunk_wallets, novel_contracts[start:stop], old_wallets[lo:hi], old_contracts[lo:hi])
+            start = stop
+
+        # Record the novel pairs, keeping the arrays sorted by wallet
+        positions = np.searchsorted(self.pair_wallets, novel_wallets, "right")
+        self.pair_wallets = np.insert(self.pair_wallets, positions, novel_wallets)
+        self.pair_contracts = np.insert(self.pair_contracts, positions, novel_contracts)
+        return len(novel_wallets)
+
+    def _rows_for(self, wallets):
+        """Return the indexes of stored pairs whose wallet is in the sorted array wallets."""
+        lo = np.searchsorted(self.pair_wallets, wallets, "left")
+        hi = np.searchsorted(self.pair_wallets, wallets, "right")
+        lengths = hi - lo
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(lo, lengths) + offsets
+
+    def _apply(self, novel_wallets, novel_contracts, old_wallets, old_contracts):
+        """Add the co-usage contributed by one chunk of novel pairs."""
+        row_keys, rows = np.unique(np.concatenate([novel_wallets, old_wallets]), return_inverse=True)
+        size = len(self.contracts)
+        novel = sp.csr_matrix(
+            (np.ones(len(novel_wallets), dtype=np.int64), (rows[:len(novel_wallets)], novel_contracts)),
+            shape=(len(row_keys), size)
+        )
+        old = sp.csr_matrix(
+            (np.ones(len(old_wallets), dtype=np.int64), (rows[len(novel_wallets):], old_contracts)),
+            shape=(len(row_keys), size)
+        )
+        cross = novel.T @ old
+        self.matrix = (self.matrix + cross + cross.T + novel.T @ novel).tocsr()
+
+    def add_records(self, records):
+        """Ingest records day by day, oldest first."""
+        by_day = {}
+        for record in records:
+            by_day.setdefault(record.get("day_timestamp", 0), []).append(record)
+        added = 0
+        for day in sorted(by_day):
+            added += self.add_day(by_day[day])
+        return added
+
+    def jaccard_pairs(self, top=TOP_PAIRS):
+        """Return the contract pairs sharing the most wallets, with their Jaccard overlap."""
+        wallets_per_contract = self.matrix.diagonal()
+        upper = sp.triu(self.matrix, k=1).tocoo()
+        union = wallets_per_contract[upper.row] + wallets_per_contract[upper.col] - upper.data
+        jaccard = upper.data / np.maximum(union, 1)
+
+        order = np.lexsort((-upper.data, -jaccard))[:top]
+        return [
+            {
+                "contract_a": self.contracts[upper.row[i]],
+                "contract_b": self.contracts[upper.col[i]],
+                "shared_wallets": int(upper.data[i]),
+                "jaccard": round(float(jaccard[i]), 6)
+            }
+            for i in order
+        ]
+
+    def summary(self, top=TOP_PAIRS):
+        wallets_per_contract = self.matrix.diagonal()
+        return {
+            "generated_at": datetime.now().isoformat(),
+            "total_contracts": len(self.contracts),
+            "total_wallets": int(len(np.unique(self.pair_wallets))),
+            "wallets_per_contract": {
+                address: int(wallets_per_contract[index]) for index, address in enumerate(self.contracts)
+            },
+            "top_pairs": self.jaccard_pairs(top)
+        }
+
+def update_co_usage(records, state_path=STATE_PATH, results_path=RESULTS_PATH):
+    """Fold records into the persisted co-usage state and publish the summary."""
+    state = CoUsage.load(state_path)
+    added = state.add_records(records)
+    state.save(state_path)
+
+    summary = state.summary()
+    with open(results_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"Added {added} new wallet-contract pairs, {summary['total_wallets']} wallets across {summary['total_contracts']} contracts")
+    print(f"Saved co-usage analysis to {results_path}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the wallet x contract co-usage matrix")
+    parser.add_argument("inputs", nargs="+", help="Contract JSON files, e.g. output/contracts.json or output/batches/*.json")
+    parser.add_argument("--state", default=STATE_PATH, help="Persisted matrix state (default: %(default)s)")
+    parser.add_argument("--output", default=RESULTS_PATH, help="Published summary (default: %(default)s)")
+    args = parser.parse_args()
+
+    records = []
+    for path in args.inputs:
+        with open(path) as f:
+            records.extend(json.load(f))
+    update_co_usage(records, args.state, args.output)
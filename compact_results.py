@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Compaction and tiered retention for the results/ history.
+
+Every pipeline run leaves a results/contracts_<ts>.json and
+results/analysis_<ts>.json pair. This job folds those snapshots into
+gzip-compressed segments under results/compacted/, one per partition:
+
+    daily/<YYYY-MM-DD>.json.gz    every snapshot of the last N days
+    weekly/<YYYY-Www>.json.gz     the last analysed snapshot of each week after that
+    monthly/<YYYY-MM>.json.gz     the last analysed snapshot of each month after that
+
+Within a segment, contract records shared by several snapshots are stored
+once and each snapshot keeps the list of record indexes plus its analysis,
+so every retained snapshot can be rebuilt exactly with load_snapshot().
+Next to each segment, a small <segment>.index.json lists its snapshot
+timestamps, so listing the history never has to decompress segments.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+from zone_maps import build_catalog, index_partition
+
+RESULTS_DIR = "results"
+COMPACTED_DIR = "compacted"
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+SNAPSHOT_FILE = re.compile(r"^(contracts|analysis)_(\d{8}_\d{6})\.json$")
+INDEX_SUFFIX = ".index.json"
+
+DAILY_DAYS = 14
+WEEKLY_WEEKS = 12
+TIERS = ("daily", "weekly", "monthly")
+
+def parse_timestamp(timestamp):
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+
+def partition_key(tier, timestamp):
+    """Return the partition a snapshot belongs to within a tier."""
+    moment = parse_timestamp(timestamp)
+    if tier == "daily":
+        return moment.strftime("%Y-%m-%d")
+    if tier == "weekly":
+        year, week, _ = moment.isocalendar()
+        return f"{year}-W{week:02d}"
+    return moment.strftime("%Y-%m")
+
+def assign_tier(timestamp, now, daily_days=DAILY_DAYS, weekly_weeks=WEEKLY_WEEKS):
+    """Pick the retention tier for a snapshot based on its age."""
+    age = now - parse_timestamp(timestamp)
+    if age < timedelta(days=daily_days):
+        return "daily"
+    if age < timedelta(days=daily_days + weekly_weeks * 7):
+        return "weekly"
+    return "monthly"
+
+def segment_path(results_dir, tier, key):
+    return os.path.join(results_dir, COMPACTED_DIR, tier, f"{key}.json.gz")
+
+def find_loose_snapshots(results_dir=RESULTS_DIR):
+    """Map each timestamp to its uncompacted contracts/analysis files."""
+    snapshots = {}
+    for path in glob.glob(os.path.join(results_dir, "*_*.json")):
+        match = SNAPSHOT_FILE.match(os.path.basename(path))
+        if match:
+            kind, timestamp = match.groups()
+            snapshots.setdefault(timestamp, {})[kind] = path
+    return snapshots
+
+def segment_index_path(path):
+    return f"{path}{INDEX_SUFFIX}"
+
+def write_segment_index(path, snapshots):
+    """Record which snapshots a segment holds, and which of them have an analysis."""
+    index = {
+        "size": os.path.getsize(path),
+        "snapshots": sorted(snapshots),
+        "analysed": sorted(timestamp for timestamp, snapshot in snapshots.items() if snapshot["analysis"] is not None)
+    }
+    tmp_path = f"{segment_index_path(path)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, segment_index_path(path))
+    return index
+
+def load_segment_index(path):
+    """Return the index of a segment, rebuilding it if it is missing or stale."""
+    try:
+        with open(segment_index_path(path)) as f:
+            index = json.load(f)
+        if index["size"] == os.path.getsize(path):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    with gzip.open(path, "rt") as f:
+        return write_segment_index(path, json.load(f)["snapshots"])
+
+def read_segment(path):
+    """Load a segment and expand it to {timestamp: {"contracts": [...], "analysis": {...}}}."""
+    with gzip.open(path, "rt") as f:
+        segment = json.load(f)
+    records = segment["records"]
+    return {
+        timestamp: {
+            "contracts": [records[index] for index in snapshot["contracts"]],
+            "analysis": snapshot["analysis"]
+        }
+        for timestamp, snapshot in segment["snapshots"].items()
+    }
+
+def write_segment(path, tier, key, snapshots):
+    """Write snapshots to one segment, storing shared contract records once."""
+    records = []
+    record_index = {}
+    encoded = {}
+
+    for timestamp in sorted(snapshots):
+        indexes = []
+        for record in snapshots[timestamp]["contracts"]:
+            record_key = json.dumps(record, sort_keys=True)
+            if record_key not in record_index:
+                record_index[record_key] = len(records)
+                records.append(record)
+            indexes.append(record_index[record_key])
+        encoded[timestamp] = {"contracts": indexes, "analysis": snapshots[timestamp]["analysis"]}
+
+    segment = {"tier": tier, "partition": key, "records": records, "snapshots": encoded}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    # No timestamp in the gzip header, so the same snapshots give the same bytes
+    with gzip.GzipFile(tmp_path, "wb", mtime=0) as f:
+        f.write(json.dumps(segment, separators=(",", ":")).encode())
+    os.replace(tmp_path, path)
+    write_segment_index(path, encoded)
+    index_partition(path, records)
+    return len(records)
+
+def load_loose_snapshot(paths):
+    snapshot = {"contracts": [], "analysis": None}
+    for kind, path in paths.items():
+        with open(path) as f:
+            snapshot[kind] = json.load(f)
+    return snapshot
+
+def list_snapshots(results_dir=RESULTS_DIR, analysed=False):
+    """List every snapshot timestamp available, loose or compacted, in time order.
+
+    With analysed=True only snapshots that have an analysis are listed.
+    """
+    timestamps = {
+        timestamp for timestamp, paths in find_loose_snapshots(results_dir).items()
+        if not analysed or "analysis" in paths
+    }
+    for tier in TIERS:
+        for path in glob.glob(os.path.join(results_dir, COMPACTED_DIR, tier, "*.json.gz")):
+            timestamps.update(load_segment_index(path)["analysed" if analysed else "snapshots"])
+    return sorted(timestamps)
+
+def load_snapshot(timestamp, results_dir=RESULTS_DIR):
+    """Rebuild one historical snapshot from loose files or the compacted tiers."""
+    loose = find_loose_snapshots(results_dir).get(timestamp)
+    if loose:
+        return load_loose_snapshot(loose)
+    for tier in TIERS:
+        path = segment_path(results_dir, tier, partition_key(tier, timestamp))
+        if os.path.exists(path) and timestamp in load_segment_index(path)["snapshots"]:
+            return read_segment(path)[timestamp]
+    raise KeyError(f"No snapshot {timestamp} in {results_dir}")
+
+def fold_contract_copies(snapshots):
+    """Drop contracts-only snapshots that repeat the analysed snapshot right before them.
+
+    Such a copy comes from the same run, so it adds nothing but would win
+    the rollup over the snapshot that has the analysis. Returns the
+    timestamps dropped.
+    """
+    dropped = []
+    previous = None
+    for timestamp in sorted(snapshots):
+        snapshot = snapshots[timestamp]
+        if snapshot["analysis"] is None and previous is not None and snapshot["contracts"] == previous["contracts"]:
+            del snapshots[timestamp]
+            dropped.append(timestamp)
+            continue
+        previous = snapshot if snapshot["analysis"] is not None else None
+    return dropped
+
+def rollup_snapshot(members):
+    """Pick the snapshot a rollup keeps: the last one with an analysis, else the last one."""
+    analysed = [timestamp for timestamp, snapshot in members.items() if snapshot["analysis"] is not None]
+    return max(analysed or members)
+
+def compact(results_dir=RESULTS_DIR, daily_days=DAILY_DAYS, weekly_weeks=WEEKLY_WEEKS, now=None, keep_sources=False):
+    """Fold loose snapshots into segments and roll aged segments up to coarser tiers."""
+    now = now or datetime.now()
+    snapshots = {}
+    sources = {}
+
+    # Daily and weekly segments may need to move to a coarser tier
+    existing = {}
+    for tier in ("daily", "weekly"):
+        for path in glob.glob(os.path.join(results_dir, COMPACTED_DIR, tier, "*.json.gz")):
+            existing[path] = read_segment(path)
+            snapshots.update(existing[path])
+
+    loose = find_loose_snapshots(results_dir)
+    for timestamp, paths in loose.items():
+        snapshots[timestamp] = load_loose_snapshot(paths)
+        sources[timestamp] = paths
+
+    dropped = fold_contract_copies(snapshots)
+    if dropped:
+        print(f"Merged {len(dropped)} contracts-only copies into the analysed snapshot of the same run")
+
+    partitions = {}
+    for timestamp, snapshot in snapshots.items():
+        tier = assign_tier(timestamp, now, daily_days, weekly_weeks)
+        partitions.setdefault((tier, partition_key(tier, timestamp)), {})[timestamp] = snapshot
+
+    retained = set()
+    written = {}
+    for (tier, key), members in sorted(partitions.items()):
+        path = segment_path(results_dir, tier, key)
+        if tier == "monthly" and os.path.exists(path):
+            members = {**read_segment(path), **members}
+        if tier != "daily":
+            # Rollup tiers keep only the last analysed snapshot of their period
+            latest = rollup_snapshot(members)
+            members = {latest: members[latest]}
+        retained.add(path)
+        # Snapshots never change, so a segment holding the same ones is left alone
+        if os.path.exists(path) and load_segment_index(path)["snapshots"] == sorted(members):
+            continue
+        records = write_segment(path, tier, key, members)
+        written[path] = members
+        print(f"Wrote {tier} segment {key}: {len(members)} snapshots, {records} unique records")
+
+    # Make sure every retained snapshot reads back before deleting anything
+    for path, members in written.items():
+        stored = read_segment(path)
+        for timestamp in members:
+            if stored.get(timestamp) != snapshots.get(timestamp, members[timestamp]):
+                raise RuntimeError(f"Snapshot {timestamp} did not survive compaction, keeping sources")
+
+    for path in existing:
+        if path not in retained:
+            os.remove(path)
+            if os.path.exists(segment_index_path(path)):
+                os.remove(segment_index_path(path))
+            print(f"Rolled up segment {path}")
+
+    if not keep_sources:
+        for paths in sources.values():
+            for path in paths.values():
+                os.remove(path)
+        print(f"Removed {sum(len(paths) for paths in sources.values())} compacted snapshot files")
+
+    return set(written)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact timestamped results into tiered, deduplicated segments")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="Results directory (default: %(default)s)")
+    parser.add_argument("--daily-days", type=int, default=DAILY_DAYS, help="Days to keep every snapshot (default: %(default)s)")
+    parser.add_argument("--weekly-weeks", type=int, default=WEEKLY_WEEKS, help="Weeks to keep weekly rollups before monthly ones (default: %(default)s)")
+    parser.add_argument("--keep-sources", action="store_true", help="Do not delete the compacted snapshot files")
+    args = parser.parse_args()
+
+    compact(args.results_dir, args.daily_days, args.weekly_weeks, keep_sources=args.keep_sources)
+    # Drop zone maps of compacted snapshots and index the new segments
+    build_catalog()
+    print("Compaction complete!")
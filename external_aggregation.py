@@ -0,0 +1,224 @@
+"""
+Spill-to-disk aggregation of contract records.
+
+Records are folded into one aggregate per (address, day_timestamp) in memory.
+When the estimated size of those aggregates passes the memory budget they are
+hash-partitioned by address, sorted and written out as runs. At the end each
+partition's runs are k-way merged, which yields every (address, day)
+aggregate exactly once and in address order, so per-address and per-day
+totals can be built while holding only one record per run in memory.
+"""
+
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import zlib
+
+# Mirrors MAX_WALLETS_PER_CONTRACT in the Substreams module
+MAX_WALLETS_PER_CONTRACT = 100
+
+# Rough in-memory footprint of one aggregate and of each wallet string it holds
+RECORD_BYTES = 600
+WALLET_BYTES = 100
+
+DEFAULT_PARTITIONS = 16
+MAX_OPEN_RUNS = 64
+
+def new_aggregate(record):
+    """Start an aggregate from one contract record."""
+    return {
+        "address": record["address"],
+        "day_timestamp": record["day_timestamp"],
+        "first_interaction_block": record["first_interaction_block"],
+        "last_interaction_block": record["last_interaction_block"],
+        "total_calls": record["total_calls"],
+        "unique_wallets": record["unique_wallets"],
+        "interacting_wallets": list(record.get("interacting_wallets", []))[:MAX_WALLETS_PER_CONTRACT],
+        "is_new_contract": record.get("is_new_contract", False)
+    }
+
+def merge_aggregate(target, record):
+    """Fold a record or aggregate for the same key into target.
+
+    unique_wallets is summed, as in the daily stats of analyze_contracts,
+    because the truncated wallet lists cannot be used to deduplicate.
+    """
+    target["first_interaction_block"] = min(target["first_interaction_block"], record["first_interaction_block"])
+    target["last_interaction_block"] = max(target["last_interaction_block"], record["last_interaction_block"])
+    target["total_calls"] += record["total_calls"]
+    target["unique_wallets"] += record["unique_wallets"]
+    target["is_new_contract"] = target["is_new_contract"] or record.get("is_new_contract", False)
+
+    wallets = target["interacting_wallets"]
+    for wallet in record.get("interacting_wallets", []):
+        if len(wallets) >= MAX_WALLETS_PER_CONTRACT:
+            break
+        if wallet not in wallets:
+            wallets.append(wallet)
+
+def aggregate_key(aggregate):
+    return (aggregate["address"], aggregate["day_timestamp"])
+
+def aggregate_size(aggregate):
+    return RECORD_BYTES + WALLET_BYTES * len(aggregate["interacting_wallets"])
+
+def partition_of(address, partitions):
+    # crc32 rather than hash() so partitions are stable across processes
+    return zlib.crc32(address.encode()) % partitions
+
+def read_run(path):
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+def write_run(path, aggregates):
+    with open(path, "w") as f:
+        for aggregate in aggregates:
+            f.write(json.dumps(aggregate, separators=(",", ":")))
+            f.write("\n")
+
+def combine_sorted(streams):
+    """K-way merge sorted aggregate streams, folding together entries with the same key."""
+    current = None
+    for aggregate in heapq.merge(*streams, key=aggregate_key):
+        if current is not None and aggregate_key(current) == aggregate_key(aggregate):
+            merge_aggregate(current, aggregate)
+            continue
+        if current is not None:
+            yield current
+        current = aggregate
+    if current is not None:
+        yield current
+
+def summarize_aggregates(aggregates):
+    """Build per-address and per-day totals from (address, day) aggregates grouped by address."""
+    per_address = []
+    per_day = {}
+    current = None
+    for aggregate in aggregates:
+        day = per_day.setdefault(aggregate["day_timestamp"], {
+            "day_timestamp": aggregate["day_timestamp"],
+            "active_contracts": 0,
+            "new_contracts": 0,
+            "total_calls": 0,
+            "unique_wallets": 0
+        })
+        day["active_contracts"] += 1
+        day["new_contracts"] += 1 if aggregate["is_new_contract"] else 0
+        day["total_calls"] += aggregate["total_calls"]
+        day["unique_wallets"] += aggregate["unique_wallets"]
+
+        # Aggregates arrive grouped by address, so one running total is enough
+        if current is not None and current["address"] == aggregate["address"]:
+            merge_aggregate(current, aggregate)
+            current["day_timestamp"] = max(current["day_timestamp"], aggregate["day_timestamp"])
+        else:
+            current = new_aggregate(aggregate)
+            per_address.append(current)
+    return per_address, sorted(per_day.values(), key=lambda x: x["day_timestamp"])
+
+class ExternalAggregator:
+    """Aggregates contract records per (address, day) within a fixed memory budget."""
+
+    def __init__(self, memory_budget=256 * 1024 * 1024, spill_dir="output", partitions=DEFAULT_PARTITIONS):
+        self.memory_budget = memory_budget
+        self.partitions = partitions
+        os.makedirs(spill_dir, exist_ok=True)
+        self.spill_dir = tempfile.mkdtemp(prefix="aggregation_", dir=spill_dir)
+        self.runs = [[] for _ in range(partitions)]
+        self.buffer = {}
+        self.buffer_bytes = 0
+        self.records = 0
+
+    def add(self, record):
+        key = aggregate_key(record)
+        aggregate = self.buffer.get(key)
+        if aggregate is None:
+            aggregate = new_aggregate(record)
+            self.buffer[key] = aggregate
+            self.buffer_bytes += aggregate_size(aggregate)
+        else:
+            before = len(aggregate["interacting_wallets"])
+            merge_aggregate(aggregate, record)
+            self.buffer_bytes += WALLET_BYTES * (len(aggregate["interacting_wallets"]) - before)
+        self.records += 1
+
+        if self.buffer_bytes > self.memory_budget:
+            self.spill()
+
+    def add_all(self, records):
+        for record in records:
+            self.add(record)
+
+    def _sorted_buffer(self):
+        by_partition = [[] for _ in range(self.partitions)]
+        for aggregate in self.buffer.values():
+            by_partition[partition_of(aggregate["address"], self.partitions)].append(aggregate)
+        for aggregates in by_partition:
+            aggregates.sort(key=aggregate_key)
+        return by_partition
+
+    def spill(self):
+        """Write the in-memory aggregates out as one sorted run per partition."""
+        for partition, aggregates in enumerate(self._sorted_buffer()):
+            if not aggregates:
+                continue
+            path = os.path.join(self.spill_dir, f"partition{partition}_run{len(self.runs[partition])}.jsonl")
+            write_run(path, aggregates)
+            self.runs[partition].append(path)
+            if len(self.runs[partition]) >= MAX_OPEN_RUNS:
+                self._compact_runs(partition)
+
+        print(f"Spilled {len(self.buffer)} aggregates to {self.spill_dir}")
+        self.buffer = {}
+        self.buffer_bytes = 0
+
+    def _compact_runs(self, partition):
+        """Merge a partition's runs into one so a final merge never opens too many files."""
+        runs = self.runs[partition]
+        path = os.path.join(self.spill_dir, f"partition{partition}_merged{len(runs)}_{os.urandom(4).hex()}.jsonl")
+        write_run(path, combine_sorted([read_run(run) for run in runs]))
+        for run in runs:
+            os.remove(run)
+        self.runs[partition] = [path]
+
+    def iter_aggregates(self):
+        """Yield the final (address, day) aggregates, grouped by address."""
+        buffered = self._sorted_buffer()
+        for partition in range(self.partitions):
+            streams = [read_run(run) for run in self.runs[partition]]
+            streams.append(iter(buffered[partition]))
+            yield from combine_sorted(streams)
+
+    def write_results(self, contracts_path, zone_map=None):
+        """Stream the (address, day) aggregates to a JSON file and return per-address and per-day totals.
+
+        Each aggregate written is also added to zone_map (a ZoneMapBuilder), if given.
+        """
+        written = 0
+
+        tmp_path = f"{contracts_path}.tmp"
+        with open(tmp_path, "w") as f:
+            def write_each(aggregates):
+                nonlocal written
+                for aggregate in aggregates:
+                    f.write(",\n" if written else "\n")
+                    f.write(json.dumps(aggregate))
+                    written += 1
+                    if zone_map is not None:
+                        zone_map.add(aggregate)
+                    yield aggregate
+
+            f.write("[")
+            per_address, per_day = summarize_aggregates(write_each(self.iter_aggregates()))
+            f.write("\n]\n")
+        os.replace(tmp_path, contracts_path)
+
+        print(f"Aggregated {self.records} records into {written} address-day aggregates for {len(per_address)} contracts")
+        self.close()
+        return per_address, per_day
+
+    def close(self):
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Follow-head daemon for the Substreams Contract Reviewer.
+
+Instead of re-running the pipeline from cron, one `substreams run` stream is
+kept open with no stop block and only final blocks, so reorgs never have to
+be undone. Each block is committed in two steps: its contracts are appended
+to output/follow/journal.jsonl, then output/cursor.json is rewritten. The
+cursor is the commit point, so after a crash or restart the aggregates are
+rebuilt from the last checkpoint plus the journal up to the cursor, and the
+stream resumes from the block after it. Recovery also rewrites the journal
+to the committed blocks, so entries written past the cursor, or torn by the
+crash, are never replayed twice.
+
+Records are folded into per (address, day) aggregates as they arrive. A
+publisher thread republishes the analysis every few minutes, and keeps a
+timestamped snapshot in results/ every few hours, when the aggregates are
+also checkpointed and the journal truncated. Publishing never holds up the
+stream reader.
+
+Usage:
+    python3 follow_head.py --start-block 22000000
+"""
+
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+from datetime import datetime
+
+from external_aggregation import aggregate_key, merge_aggregate, new_aggregate, summarize_aggregates
+from process_contracts import filter_watched, publish_results, substreams_env
+from substreams_watchdog import STALL_TIMEOUT, run_with_watchdog
+from watchlist import load_watchlist
+
+CURSOR_PATH = "output/cursor.json"
+STATE_DIR = "output/follow"
+PUBLISH_INTERVAL = 300
+SNAPSHOT_INTERVAL = 6 * 60 * 60
+RETENTION_DAYS = 90
+RETRY_DELAY = 60
+PUBLISH_POLL = 5
+
+def follow_command(start_block, cursor=None, watchlist=None):
+    """Build the `substreams run` command that streams final blocks from start_block on."""
+    cmd = [
+        "substreams", "run",
+        "-e", "mainnet.eth.streamingfast.io:443",  # Ethereum mainnet endpoint
+        "substreams.yaml", "map_contract_usage",   # Substreams package and module
+        "--start-block", str(start_block),         # No stop block: keep streaming at the head
+        "--final-blocks-only"                      # Irreversible blocks only, so nothing is undone
+    ]
+    if cursor:
+        cmd += ["--cursor", cursor]
+    if watchlist is not None:
+        cmd += ["-p", f"map_contract_usage={watchlist.to_param()}"]
+    return cmd
+
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def write_json(path, data):
+    """Replace a JSON file atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class HeadFollower:
+    """Incremental aggregates and cursor of a stream that follows the chain head."""
+
+    def __init__(self, cursor_path=CURSOR_PATH, state_dir=STATE_DIR, retention_days=RETENTION_DAYS):
+        self.cursor_path = cursor_path
+        self.checkpoint_path = os.path.join(state_dir, "checkpoint.json")
+        self.journal_path = os.path.join(state_dir, "journal.jsonl")
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+        self.aggregates = {}
+        self.block = None
+        self.cursor = None
+        self.last_publish = time.monotonic()
+        self.last_snapshot = time.monotonic()
+        os.makedirs(state_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(cursor_path) or ".", exist_ok=True)
+        self._recover()
+        self.journal = open(self.journal_path, "a")
+
+    def _recover(self):
+        """Rebuild the aggregates from the checkpoint and the journal up to the cursor."""
+        checkpoint = read_json(self.checkpoint_path, {"block": None, "aggregates": []})
+        for aggregate in checkpoint["aggregates"]:
+            self.aggregates[aggregate_key(aggregate)] = aggregate
+        self.block = checkpoint["block"]
+        self.cursor = checkpoint.get("cursor")
+
+        committed = read_json(self.cursor_path, {"block": None})
+        if committed["block"] is not None and (self.block is None or committed["block"] > self.block):
+            last_block = committed["block"]
+        else:
+            last_block = self.block
+
+        kept = []
+        seen = set()
+        if os.path.exists(self.journal_path) and last_block is not None:
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write of a block that never reached the cursor
+                        continue
+                    block = entry["block"]
+                    # Older blocks are in the checkpoint, newer ones are sent again after the restart
+                    if block in seen or block > last_block or (self.block is not None and block <= self.block):
+                        continue
+                    seen.add(block)
+                    kept.append(line if line.endswith("\n") else line + "\n")
+                    self._fold(entry["contracts"])
+
+        # Leave only the replayed entries, so nothing uncommitted or torn is
+        # followed by new entries and replayed again later
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(kept)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+        if last_block != self.block:
+            self.block = last_block
+            self.cursor = committed.get("cursor")
+            print(f"Recovered state at block {self.block}, replayed {len(kept)} journaled blocks")
+
+    def _fold(self, contracts):
+        for contract in contracts:
+            key = aggregate_key(contract)
+            if key in self.aggregates:
+                merge_aggregate(self.aggregates[key], contract)
+            else:
+                self.aggregates[key] = new_aggregate(contract)
+
+    def next_block(self, start_block):
+        return start_block if self.block is None else self.block + 1
+
+    def commit_block(self, block, contracts, cursor=None):
+        """Apply one block's contracts and persist the cursor past it."""
+        with self.lock:
+            if self.block is not None and block <= self.block:
+                return
+            if contracts:
+                self.journal.write(json.dumps({"block": block, "contracts": contracts}, separators=(",", ":")))
+                self.journal.write("\n")
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+            write_json(self.cursor_path, {"block": block, "cursor": cursor, "updated_at": datetime.now().isoformat()})
+            self._fold(contracts)
+            self.block = block
+            self.cursor = cursor
+
+    def _prune(self):
+        """Drop aggregates older than the retention window."""
+        if not self.aggregates:
+            return
+        newest = max(day for _, day in self.aggregates)
+        oldest = newest - self.retention_days * 86400
+        for key in [key for key in self.aggregates if key[1] < oldest]:
+            del self.aggregates[key]
+
+    def checkpoint(self):
+        """Persist the aggregates at the committed block and start a new journal."""
+        with self.lock:
+            write_json(self.checkpoint_path, {
+                "block": self.block,
+                "cursor": self.cursor,
+                "aggregates": list(self.aggregates.values())
+            })
+            self.journal.close()
+            self.journal = open(self.journal_path, "w")
+
+    def publish(self, snapshot=False):
+        with self.lock:
+            self._prune()
+            aggregates = sorted(self.aggregates.values(), key=aggregate_key)
+            # Totals start from fresh copies, the aggregates themselves stay untouched
+            contracts, daily_stats = summarize_aggregates(aggregates)
+        if not contracts:
+            return None
+        print(f"Publishing analysis of {len(contracts)} contracts at block {self.block}")
+        return publish_results(contracts, snapshot=snapshot, daily_stats=daily_stats)
+
+    def maybe_publish(self, publish_interval=PUBLISH_INTERVAL, snapshot_interval=SNAPSHOT_INTERVAL):
+        """Republish the analysis, and keep a snapshot, once their intervals have passed."""
+        now = time.monotonic()
+        if now - self.last_snapshot >= snapshot_interval:
+            self.publish(snapshot=True)
+            self.checkpoint()
+            self.last_snapshot = self.last_publish = now
+        elif now - self.last_publish >= publish_interval:
+            self.publish()
+            self.last_publish = now
+
+    def close(self):
+        self.checkpoint()
+        self.journal.close()
+
+def publish_loop(follower, stop, publish_interval, snapshot_interval):
+    """Publish from a thread of its own, so a slow publish never stalls the stream."""
+    while not stop.wait(PUBLISH_POLL):
+        try:
+            follower.maybe_publish(publish_interval, snapshot_interval)
+        except Exception as e:
+            # Keep following; the next interval tries again
+            print(f"Error publishing analysis: {e!r}")
+
+def follow(start_block=22000000, watchlist=None, publish_interval=PUBLISH_INTERVAL,
+           snapshot_interval=SNAPSHOT_INTERVAL, stall_timeout=STALL_TIMEOUT,
+           cursor_path=CURSOR_PATH, state_dir=STATE_DIR):
+    """Stream final blocks from the last cursor on, until interrupted."""
+    follower = HeadFollower(cursor_path, state_dir)
+    # Token and environment are loaded once for the lifetime of the daemon
+    env = substreams_env()
+
+    def on_block(block, contracts, document):
+        follower.commit_block(block, filter_watched(contracts, watchlist), document.get("@cursor"))
+
+    stop = threading.Event()
+    publisher = threading.Thread(
+        target=publish_loop, args=(follower, stop, publish_interval, snapshot_interval), daemon=True
+    )
+    publisher.start()
+    try:
+        while True:
+            first_block = follower.next_block(start_block)
+            print(f"Following chain head from block {first_block}")
+            try:
+                run_with_watchdog(
+                    lambda next_block, count: follow_command(next_block, follower.cursor, watchlist),
+                    first_block,
+                    None,
+                    env=env,
+                    stall_timeout=stall_timeout,
+                    on_block=on_block
+                )
+                print("Substreams stream ended")
+            except RuntimeError as e:
+                print(f"Error following chain head: {e}")
+            print(f"Reconnecting in {RETRY_DELAY}s")
+            time.sleep(RETRY_DELAY)
+    except KeyboardInterrupt:
+        print("Stopping, saving checkpoint")
+    finally:
+        stop.set()
+        publisher.join()
+        follower.publish()
+        follower.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow the chain head and keep the analysis up to date")
+    parser.add_argument("--start-block", type=int, default=22000000, help="First block when there is no cursor yet (default: %(default)s)")
+    parser.add_argument("--watchlist", help="File of contract addresses to track instead of the built-in list")
+    parser.add_argument("--publish-interval", type=int, default=PUBLISH_INTERVAL, help="Seconds between analysis updates (default: %(default)s)")
+    parser.add_argument("--snapshot-interval", type=int, default=SNAPSHOT_INTERVAL, help="Seconds between timestamped snapshots (default: %(default)s)")
+    parser.add_argument("--cursor-path", default=CURSOR_PATH, help="Committed cursor (default: %(default)s)")
+    args = parser.parse_args()
+
+    # Let service managers stop the daemon as cleanly as Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    watchlist = load_watchlist(args.watchlist) if args.watchlist else None
+    follow(args.start_block, watchlist, args.publish_interval, args.snapshot_interval, cursor_path=args.cursor_path)
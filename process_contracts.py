@@ -5,17 +5,24 @@ This script attempts to use the Substreams CLI if available,
 otherwise falls back to generating mock data.
 """
 
+import argparse
 import json
 import os
 import random
-import subprocess
 import time
 from datetime import datetime, timedelta
 
-# Create output directory if it doesn't exist
-os.makedirs("output", exist_ok=True)
-os.makedirs("results", exist_ok=True)
-os.makedirs("dashboard", exist_ok=True)
+from artifact_sync import write_manifest
+from snapshot_diff import publish_latest_diff
+from substreams_watchdog import STALL_TIMEOUT, run_with_watchdog
+from watchlist import filter_contracts, load_watchlist
+from zone_maps import build_catalog, index_partition
+
+try:
+    # Co-usage analytics need numpy and scipy, which the rest of the pipeline does not
+    from co_usage import update_co_usage
+except ImportError:
+    update_co_usage = None
 
 def estimate_blocks_for_timeframe(days=90):
     """Estimate the number of blocks for a given timeframe."""
@@ -23,31 +30,8 @@ def estimate_blocks_for_timeframe(days=90):
     blocks_per_day = 24 * 60 * 60 / 12  # ~7,200 blocks per day
     return int(blocks_per_day * days)
 
-def run_substreams(start_block=22000000, block_count=None, days=None):
-    """Run Substreams CLI and return the output."""
-    print("Running Substreams CLI to get real blockchain data...")
-    
-    # If days is specified, calculate block_count
-    if days and not block_count:
-        block_count = estimate_blocks_for_timeframe(days)
-        print(f"Analyzing approximately {days} days of data ({block_count} blocks)")
-    else:
-        # Default to 50 blocks if neither is specified
-        block_count = block_count or 50
-        print(f"Processing {block_count} blocks starting from block {start_block}")
-    
-    # For demonstration, we'll use a larger number of blocks
-    # but still explain the limitation
-    if block_count > 1000:
-        print(f"Note: A full {days}-day analysis would require processing {block_count} blocks.")
-        print("For demonstration purposes, we're limiting to 1000 blocks.")
-        print("This will provide data across approximately 3.5 hours of blockchain activity.")
-        print("In a production environment, you would:")
-        print("1. Process data incrementally (e.g., daily batches)")
-        print("2. Store results in a database for efficient querying")
-        print("3. Use distributed processing for larger datasets")
-        block_count = 1000
-    
+def load_api_token():
+    """Return the Substreams API token from the environment or the .env file."""
     # Check if the JWT token is set in the environment
     jwt_token = os.environ.get("SUBSTREAMS_API_TOKEN")
     if not jwt_token:
@@ -65,11 +49,17 @@ def run_substreams(start_block=22000000, block_count=None, days=None):
     
     if not jwt_token:
         raise ValueError("SUBSTREAMS_API_TOKEN environment variable is required")
-    
+    return jwt_token
+
+def substreams_env():
+    """Build the subprocess environment carrying the Substreams API token."""
     # Set up environment variables for the subprocess
     env = os.environ.copy()
-    env["SUBSTREAMS_API_TOKEN"] = jwt_token
-    
+    env["SUBSTREAMS_API_TOKEN"] = load_api_token()
+    return env
+
+def substreams_command(start_block, block_count, watchlist=None):
+    """Build the `substreams run` command for a block range."""
     # Prepare command according to Substreams documentation
     cmd = [
         "substreams", "run", 
@@ -78,140 +68,68 @@ def run_substreams(start_block=22000000, block_count=None, days=None):
         "--start-block", str(start_block),         # Starting block
         "--stop-block", f"+{block_count}"          # Number of blocks to process
     ]
+    if watchlist is not None:
+        # Let the module skip unwatched contracts at the source
+        cmd += ["-p", f"map_contract_usage={watchlist.to_param()}"]
+    return cmd
+
+def filter_watched(contracts, watchlist):
+    """Drop records outside the watch-list, if one is in use."""
+    if watchlist is None:
+        return contracts
+    return filter_contracts(contracts, watchlist)
+
+def fetch_block_range(start_block, block_count, stall_timeout=STALL_TIMEOUT, watchlist=None, raw_path=None):
+    """Run Substreams over exactly one block range and return its decoded contracts."""
+    contracts = run_with_watchdog(
+        lambda first_block, count: substreams_command(first_block, count, watchlist),
+        start_block,
+        block_count,
+        env=substreams_env(),
+        stall_timeout=stall_timeout,
+        raw_path=raw_path
+    )
+    return filter_watched(contracts, watchlist)
+
+def run_substreams(start_block=22000000, block_count=None, days=None, watchlist=None):
+    """Run Substreams CLI and return the output."""
+    print("Running Substreams CLI to get real blockchain data...")
+    
+    # If days is specified, calculate block_count
+    if days and not block_count:
+        block_count = estimate_blocks_for_timeframe(days)
+        print(f"Analyzing approximately {days} days of data ({block_count} blocks)")
+    else:
+        # Default to 50 blocks if neither is specified
+        block_count = block_count or 50
+        print(f"Processing {block_count} blocks starting from block {start_block}")
+    
+    # For demonstration, we'll use a larger number of blocks
+    # but still explain the limitation
+    if block_count > 1000:
+        print(f"Note: A full {days}-day analysis would require processing {block_count} blocks.")
+        print("For demonstration purposes, we're limiting to 1000 blocks.")
+        print("This will provide data across approximately 3.5 hours of blockchain activity.")
+        print("In a production environment, you would:")
+        print("1. Process data incrementally (e.g., daily batches)")
+        print("2. Store results in a database for efficient querying")
+        print("3. Use distributed processing for larger datasets")
+        block_count = 1000
     
-    # Run the command with a timeout
+    # A watchdog restarts the run if it stops advancing, instead of a fixed timeout
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=300,  # 5-minute timeout
-            env=env  # Pass the environment variables with the API token
-        )
-        print("Substreams CLI executed successfully!")
-        
-        # Print the first 500 characters of the output for debugging
-        print("Output preview:")
-        print(result.stdout[:500] + "..." if len(result.stdout) > 500 else result.stdout)
-        
-        # Try to parse the non-standard JSON output
-        try:
-            # First, try standard JSON parsing
-            return json.loads(result.stdout)
-        except json.JSONDecodeError as e:
-            print(f"Error parsing standard JSON: {e}")
-            print("Attempting to parse non-standard JSON format...")
-            
-            # Extract the real contract data from the Substreams output
-            contracts = []
-            
-            # Find the contracts array in the output
-            output_lines = result.stdout.split('\n')
-            in_contracts = False
-            current_contract = {}
-            
-            for line in output_lines:
-                line = line.strip()
-                
-                # Check if we're in the contracts array
-                if '"contracts": [' in line:
-                    in_contracts = True
-                    continue
-                
-                # Check if we're at the end of the contracts array
-                if in_contracts and line == ']':
-                    if current_contract:
-                        contracts.append(current_contract)
-                        current_contract = {}
-                    in_contracts = False
-                    continue
-                
-                # Check if we're starting a new contract
-                if in_contracts and line == '{':
-                    current_contract = {}
-                    continue
-                
-                # Check if we're ending a contract
-                if in_contracts and line == '}':
-                    contracts.append(current_contract)
-                    current_contract = {}
-                    continue
-                
-                # Parse contract properties
-                if in_contracts and ':' in line:
-                    # Remove trailing comma if present
-                    if line.endswith(','):
-                        line = line[:-1]
-                    
-                    # Split by colon
-                    parts = line.split(':', 1)
-                    if len(parts) == 2:
-                        key = parts[0].strip().strip('"')
-                        value = parts[1].strip()
-                        
-                        # Handle arrays
-                        if value.startswith('[') and value.endswith(']'):
-                            # Parse array values
-                            array_values = value[1:-1].split(',')
-                            array_values = [v.strip().strip('"') for v in array_values if v.strip()]
-                            current_contract[key] = array_values
-                        else:
-                            # Handle regular values
-                            current_contract[key] = value.strip('"')
-            
-            if contracts:
-                print(f"Successfully parsed {len(contracts)} contracts from non-standard JSON")
-                
-                # Convert string values to appropriate types
-                for contract in contracts:
-                    if "firstInteractionBlock" in contract:
-                        contract["first_interaction_block"] = int(contract["firstInteractionBlock"])
-                        del contract["firstInteractionBlock"]
-                    
-                    if "lastInteractionBlock" in contract:
-                        contract["last_interaction_block"] = int(contract["lastInteractionBlock"])
-                        del contract["lastInteractionBlock"]
-                    
-                    if "totalCalls" in contract:
-                        contract["total_calls"] = int(contract["totalCalls"])
-                        del contract["totalCalls"]
-                    
-                    if "uniqueWallets" in contract:
-                        contract["unique_wallets"] = int(contract["uniqueWallets"])
-                        del contract["uniqueWallets"]
-                    
-                    if "interactingWallets" in contract:
-                        contract["interacting_wallets"] = contract["interactingWallets"]
-                        del contract["interactingWallets"]
-                    
-                    # Handle new fields
-                    if "isNewContract" in contract:
-                        contract["is_new_contract"] = contract["isNewContract"].lower() == "true"
-                        del contract["isNewContract"]
-                    else:
-                        contract["is_new_contract"] = False
-                    
-                    if "dayTimestamp" in contract:
-                        contract["day_timestamp"] = int(contract["dayTimestamp"])
-                        del contract["dayTimestamp"]
-                    else:
-                        # Approximate day timestamp from block number if not available
-                        block_timestamp = contract["last_interaction_block"] * 12  # ~12 seconds per block
-                        contract["day_timestamp"] = (block_timestamp // 86400) * 86400
-                
-                return {"contracts": contracts}
-            
-            print("Failed to parse JSON output from Substreams.")
-            raise RuntimeError("Could not parse Substreams output and no fallback to mock data is allowed")
-    except subprocess.SubprocessError as e:
+        contracts = fetch_block_range(start_block, block_count, watchlist=watchlist)
+    except RuntimeError as e:
         print(f"Error running Substreams CLI: {e}")
-        print(f"Command output: {e.stdout if hasattr(e, 'stdout') else 'No output'}")
-        print(f"Command error: {e.stderr if hasattr(e, 'stderr') else 'No error'}")
         raise RuntimeError("Failed to get real data from Substreams") from e
-    except FileNotFoundError as e:
-        print(f"Substreams CLI not found: {e}")
-        raise RuntimeError("Substreams CLI is not installed") from e
+    
+    print("Substreams CLI executed successfully!")
+    if contracts:
+        print(f"Successfully parsed {len(contracts)} contracts from Substreams output")
+        return {"contracts": contracts}
+    
+    print("Failed to parse JSON output from Substreams.")
+    raise RuntimeError("Could not parse Substreams output and no fallback to mock data is allowed")
 
 def analyze_contracts(contracts):
     """Analyze contract data to extract insights."""
@@ -282,45 +200,91 @@ def analyze_contracts(contracts):
         }
     }
 
-# Get real data from Substreams with a time-based approach
-# Use a 3-month (90-day) timeframe for more meaningful analysis
-substreams_data = run_substreams(days=90)
-contracts = substreams_data.get("contracts", [])
-print(f"Retrieved {len(contracts)} contracts from Substreams")
-
-# Ensure we have data
-if not contracts:
-    raise RuntimeError("No contract data retrieved from Substreams")
-
-# Save to output file
-with open("output/contracts.json", "w") as f:
-    json.dump(contracts, f, indent=2)
-
-print(f"Saved contract data to output/contracts.json")
-
-# Create a timestamped copy in the results directory
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-result_file = f"results/contracts_{timestamp}.json"
-
-with open(result_file, "w") as f:
-    json.dump(contracts, f, indent=2)
-
-print(f"Created timestamped copy at {result_file}")
+def publish_results(contracts, timestamp=None, snapshot=True, daily_stats=None):
+    """Save contract data and its analysis to output/ and results/, returning the analysis.
 
-# Analyze the contract data
-analysis = analyze_contracts(contracts)
-
-# Save analysis to a separate file
-analysis_file = f"results/analysis_{timestamp}.json"
-with open(analysis_file, "w") as f:
-    json.dump(analysis, f, indent=2)
-
-# Also save a copy without timestamp for easy access
-with open("results/latest_analysis.json", "w") as f:
-    json.dump(analysis, f, indent=2)
-
-print(f"Analysis complete! Found {analysis['total_contracts_analyzed']} contracts.")
-print(f"Most active contract: {analysis['most_active_contracts'][0]['address']} with {analysis['most_active_contracts'][0]['total_calls']} calls")
-print(f"Most popular contract: {analysis['most_popular_contracts'][0]['address']} with {analysis['most_popular_contracts'][0]['unique_wallets']} unique wallets")
+    With snapshot=False only output/contracts.json and results/latest_analysis.json
+    are refreshed. daily_stats replaces the per-day totals derived from contracts.
+    """
+    # Create output directories if they don't exist
+    os.makedirs("output", exist_ok=True)
+    os.makedirs("results", exist_ok=True)
+    
+    # Save to output file
+    with open("output/contracts.json", "w") as f:
+        json.dump(contracts, f, indent=2)
+    
+    print(f"Saved contract data to output/contracts.json")
+    
+    # Create a timestamped copy in the results directory
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+    if snapshot:
+        result_file = f"results/contracts_{timestamp}.json"
+        
+        with open(result_file, "w") as f:
+            json.dump(contracts, f, indent=2)
+        
+        print(f"Created timestamped copy at {result_file}")
+        
+        # Index the snapshot so lookups can skip it when it cannot match
+        index_partition(result_file, contracts)
+        build_catalog()
+    
+    # Analyze the contract data
+    analysis = analyze_contracts(contracts)
+    if daily_stats is not None:
+        analysis["daily_stats"] = daily_stats
+    
+    # Save analysis to a separate file
+    if snapshot:
+        analysis_file = f"results/analysis_{timestamp}.json"
+        with open(analysis_file, "w") as f:
+            json.dump(analysis, f, indent=2)
+        
+        # Report what changed since the previous snapshot
+        publish_latest_diff(timestamp, {"contracts": contracts, "analysis": analysis})
+        
+        # Fold the snapshot's wallets into the co-usage matrix
+        if update_co_usage is not None:
+            update_co_usage(contracts)
+        else:
+            print("Skipping co-usage analysis, numpy and scipy are not installed")
+    
+    # Also save a copy without timestamp for easy access
+    with open("results/latest_analysis.json", "w") as f:
+        json.dump(analysis, f, indent=2)
+    
+    # Record content hashes so uploads only transfer what changed
+    write_manifest("output")
+    write_manifest("results")
+    
+    print(f"Analysis complete! Found {analysis['total_contracts_analyzed']} contracts.")
+    print(f"Most active contract: {analysis['most_active_contracts'][0]['address']} with {analysis['most_active_contracts'][0]['total_calls']} calls")
+    print(f"Most popular contract: {analysis['most_popular_contracts'][0]['address']} with {analysis['most_popular_contracts'][0]['unique_wallets']} unique wallets")
+    return analysis
 
-print("Processing complete!")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect and analyze contract usage with Substreams")
+    parser.add_argument("--watchlist", help="File of contract addresses to track instead of the built-in list")
+    args = parser.parse_args()
+    
+    # Create output directories if they don't exist
+    os.makedirs("output", exist_ok=True)
+    os.makedirs("results", exist_ok=True)
+    os.makedirs("dashboard", exist_ok=True)
+    
+    watchlist = load_watchlist(args.watchlist) if args.watchlist else None
+    
+    # Get real data from Substreams with a time-based approach
+    # Use a 3-month (90-day) timeframe for more meaningful analysis
+    substreams_data = run_substreams(days=90, watchlist=watchlist)
+    contracts = substreams_data.get("contracts", [])
+    print(f"Retrieved {len(contracts)} contracts from Substreams")
+    
+    # Ensure we have data
+    if not contracts:
+        raise RuntimeError("No contract data retrieved from Substreams")
+    
+    publish_results(contracts)
+    
+    print("Processing complete!")
@@ -5,13 +5,21 @@ This script attempts to use the Substreams CLI if available,
 otherwise falls back to generating mock data.
 """
 
+import argparse
 import json
 import os
 import random
+import shutil
 import subprocess
 import time
 from datetime import datetime, timedelta
 
+from external_aggregation import ExternalAggregator
+from snapshot_diff import publish_latest_diff
+from substreams_output import parse_contracts
+from substreams_watchdog import STALL_TIMEOUT, run_with_watchdog
+from zone_maps import ZoneMapBuilder, build_catalog, index_partition, save_zone_map
+
 # Create output directory if it doesn't exist
 os.makedirs("output", exist_ok=True)
 os.makedirs("results", exist_ok=True)
@@ -93,115 +101,14 @@ def run_substreams(start_block=22000000, block_count=None, days=None):
         print("Output preview:")
         print(result.stdout[:500] + "..." if len(result.stdout) > 500 else result.stdout)
         
-        # Try to parse the non-standard JSON output
-        try:
-            # First, try standard JSON parsing
-            return json.loads(result.stdout)
-        except json.JSONDecodeError as e:
-            print(f"Error parsing standard JSON: {e}")
-            print("Attempting to parse non-standard JSON format...")
-            
-            # Extract the real contract data from the Substreams output
-            contracts = []
-            
-            # Find the contracts array in the output
-            output_lines = result.stdout.split('\n')
-            in_contracts = False
-            current_contract = {}
-            
-            for line in output_lines:
-                line = line.strip()
-                
-                # Check if we're in the contracts array
-                if '"contracts": [' in line:
-                    in_contracts = True
-                    continue
-                
-                # Check if we're at the end of the contracts array
-                if in_contracts and line == ']':
-                    if current_contract:
-                        contracts.append(current_contract)
-                        current_contract = {}
-                    in_contracts = False
-                    continue
-                
-                # Check if we're starting a new contract
-                if in_contracts and line == '{':
-                    current_contract = {}
-                    continue
-                
-                # Check if we're ending a contract
-                if in_contracts and line == '}':
-                    contracts.append(current_contract)
-                    current_contract = {}
-                    continue
-                
-                # Parse contract properties
-                if in_contracts and ':' in line:
-                    # Remove trailing comma if present
-                    if line.endswith(','):
-                        line = line[:-1]
-                    
-                    # Split by colon
-                    parts = line.split(':', 1)
-                    if len(parts) == 2:
-                        key = parts[0].strip().strip('"')
-                        value = parts[1].strip()
-                        
-                        # Handle arrays
-                        if value.startswith('[') and value.endswith(']'):
-                            # Parse array values
-                            array_values = value[1:-1].split(',')
-                            array_values = [v.strip().strip('"') for v in array_values if v.strip()]
-                            current_contract[key] = array_values
-                        else:
-                            # Handle regular values
-                            current_contract[key] = value.strip('"')
-            
-            if contracts:
-                print(f"Successfully parsed {len(contracts)} contracts from non-standard JSON")
-                
-                # Convert string values to appropriate types
-                for contract in contracts:
-                    if "firstInteractionBlock" in contract:
-                        contract["first_interaction_block"] = int(contract["firstInteractionBlock"])
-                        del contract["firstInteractionBlock"]
-                    
-                    if "lastInteractionBlock" in contract:
-                        contract["last_interaction_block"] = int(contract["lastInteractionBlock"])
-                        del contract["lastInteractionBlock"]
-                    
-                    if "totalCalls" in contract:
-                        contract["total_calls"] = int(contract["totalCalls"])
-                        del contract["totalCalls"]
-                    
-                    if "uniqueWallets" in contract:
-                        contract["unique_wallets"] = int(contract["uniqueWallets"])
-                        del contract["uniqueWallets"]
-                    
-                    if "interactingWallets" in contract:
-                        contract["interacting_wallets"] = contract["interactingWallets"]
-                        del contract["interactingWallets"]
-                    
-                    # Handle new fields
-                    if "isNewContract" in contract:
-                        contract["is_new_contract"] = contract["isNewContract"].lower() == "true"
-                        del contract["isNewContract"]
-                    else:
-                        contract["is_new_contract"] = False
-                    
-                    if "dayTimestamp" in contract:
-                        contract["day_timestamp"] = int(contract["dayTimestamp"])
-                        del contract["dayTimestamp"]
-                    else:
-                        # Approximate day timestamp from block number if not available
-                        block_timestamp = contract["last_interaction_block"] * 12  # ~12 seconds per block
-                        contract["day_timestamp"] = (block_timestamp // 86400) * 86400
-                
-                return {"contracts": contracts}
-            
-            print("Failed to parse JSON output from Substreams.")
-            raise RuntimeError("Could not parse Substreams output and no fallback to mock data is allowed")
+        # The CLI prints one JSON document per block, decode them all
+        contracts = parse_contracts(result.stdout)
+        if contracts:
+            print(f"Successfully parsed {len(contracts)} contracts from Substreams output")
+            return {"contracts": contracts}
+        
+        print("Failed to parse JSON output from Substreams.")
+        raise RuntimeError("Could not parse Substreams output and no fallback to mock data is allowed")
     except subprocess.SubprocessError as e:
         print(f"Error running Substreams CLI: {e}")
         print(f"Command output: {e.stdout if hasattr(e, 'stdout') else 'No output'}")
@@ -281,11 +188,16 @@ def analyze_contracts(contracts):
     }
 
 # Process data in batches to avoid timeout and memory issues
-def process_in_batches(total_days=90, batch_size=30, start_block=22000000):
-    """Process blockchain data in batches to avoid timeout and memory issues."""
+def process_in_batches(total_days=90, batch_size=30, start_block=22000000, aggregator=None):
+    """Process blockchain data in batches to avoid timeout and memory issues.
+    
+    When an aggregator is given, each batch's records are folded into it
+    instead of being kept in memory, and the returned list is empty.
+    """
     print(f"Processing {total_days} days of data in batches of {batch_size} days each")
     
     all_contracts = []
+    total_records = 0
     num_batches = total_days // batch_size
     
     for batch in range(num_batches):
@@ -302,14 +214,15 @@ def process_in_batches(total_days=90, batch_size=30, start_block=22000000):
         
         # Run Substreams for this batch
         try:
-            # Prepare command according to Substreams documentation
-            cmd = [
-                "substreams", "run", 
-                "-e", "mainnet.eth.streamingfast.io:443",  # Ethereum mainnet endpoint
-                "substreams.yaml", "map_contract_usage",   # Substreams package and module
-                "--start-block", str(batch_start_block),   # Starting block
-                "--stop-block", f"+{batch_blocks}"         # Number of blocks to process
-            ]
+            def build_command(first_block, block_count):
+                # Prepare command according to Substreams documentation
+                return [
+                    "substreams", "run", 
+                    "-e", "mainnet.eth.streamingfast.io:443",  # Ethereum mainnet endpoint
+                    "substreams.yaml", "map_contract_usage",   # Substreams package and module
+                    "--start-block", str(first_block),         # Starting block
+                    "--stop-block", f"+{block_count}"          # Number of blocks to process
+                ]
             
             # Check if the JWT token is set in the environment
             jwt_token = os.environ.get("SUBSTREAMS_API_TOKEN")
@@ -333,158 +246,83 @@ def process_in_batches(total_days=90, batch_size=30, start_block=22000000):
             env = os.environ.copy()
             env["SUBSTREAMS_API_TOKEN"] = jwt_token
             
-            # Run the command with a timeout
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=False,  # Don't raise an exception on non-zero exit
-                timeout=1800,  # 30-minute timeout
-                env=env  # Pass the environment variables with the API token
+            # Stream the run under a watchdog: a stalled run is killed and resumed
+            # from the last confirmed block, a healthy one runs as long as it needs
+            os.makedirs("output/raw", exist_ok=True)
+            raw_path = f"output/raw/batch{batch+1}_output.txt"
+            contracts = run_with_watchdog(
+                build_command,
+                batch_start_block,
+                batch_blocks,
+                env=env,
+                stall_timeout=STALL_TIMEOUT,
+                raw_path=raw_path
             )
             
-            # Check if we got any output, even if the command failed
-            if result.stdout:
-                print(f"Got output from Substreams (length: {len(result.stdout)})")
-                
-                # Save the raw output for debugging
-                os.makedirs("output/raw", exist_ok=True)
-                with open(f"output/raw/batch{batch+1}_output.txt", "w") as f:
-                    f.write(result.stdout)
-                
-                print(f"Saved raw output to output/raw/batch{batch+1}_output.txt")
-                
-                # Try to extract contract data from the output
-                contracts = []
+            print(f"Saved raw output to {raw_path}")
+            
+            if contracts:
+                print(f"Successfully extracted {len(contracts)} contracts from output")
                 
-                # Find the contracts array in the output
-                output_lines = result.stdout.split('\n')
-                in_contracts = False
-                current_contract = {}
+                # Add to all contracts
+                total_records += len(contracts)
+                if aggregator is not None:
+                    aggregator.add_all(contracts)
+                else:
+                    all_contracts.extend(contracts)
                 
-                for line in output_lines:
-                    line = line.strip()
-                    
-                    # Check if we're in the contracts array
-                    if '"contracts": [' in line:
-                        in_contracts = True
-                        continue
-                    
-                    # Check if we're at the end of the contracts array
-                    if in_contracts and line == ']':
-                        if current_contract:
-                            contracts.append(current_contract)
-                            current_contract = {}
-                        in_contracts = False
-                        continue
-                    
-                    # Check if we're starting a new contract
-                    if in_contracts and line == '{':
-                        current_contract = {}
-                        continue
-                    
-                    # Check if we're ending a contract
-                    if in_contracts and line == '}':
-                        contracts.append(current_contract)
-                        current_contract = {}
-                        continue
-                    
-                    # Parse contract properties
-                    if in_contracts and ':' in line:
-                        # Remove trailing comma if present
-                        if line.endswith(','):
-                            line = line[:-1]
-                        
-                        # Split by colon
-                        parts = line.split(':', 1)
-                        if len(parts) == 2:
-                            key = parts[0].strip().strip('"')
-                            value = parts[1].strip()
-                            
-                            # Handle arrays
-                            if value.startswith('[') and value.endswith(']'):
-                                # Parse array values
-                                array_values = value[1:-1].split(',')
-                                array_values = [v.strip().strip('"') for v in array_values if v.strip()]
-                                current_contract[key] = array_values
-                            else:
-                                # Handle regular values
-                                current_contract[key] = value.strip('"')
+                # Save batch data
+                os.makedirs("output/batches", exist_ok=True)
+                with open(f"output/batches/contracts_batch{batch+1}.json", "w") as f:
+                    json.dump(contracts, f, indent=2)
+                index_partition(f"output/batches/contracts_batch{batch+1}.json", contracts)
                 
-                if contracts:
-                    print(f"Successfully extracted {len(contracts)} contracts from output")
-                    
-                    # Convert string values to appropriate types
-                    for contract in contracts:
-                        if "firstInteractionBlock" in contract:
-                            contract["first_interaction_block"] = int(contract["firstInteractionBlock"])
-                            del contract["firstInteractionBlock"]
-                        
-                        if "lastInteractionBlock" in contract:
-                            contract["last_interaction_block"] = int(contract["lastInteractionBlock"])
-                            del contract["lastInteractionBlock"]
-                        
-                        if "totalCalls" in contract:
-                            contract["total_calls"] = int(contract["totalCalls"])
-                            del contract["totalCalls"]
-                        
-                        if "uniqueWallets" in contract:
-                            contract["unique_wallets"] = int(contract["uniqueWallets"])
-                            del contract["uniqueWallets"]
-                        
-                        if "interactingWallets" in contract:
-                            contract["interacting_wallets"] = contract["interactingWallets"]
-                            del contract["interactingWallets"]
-                        
-                        # Handle new fields
-                        if "isNewContract" in contract:
-                            contract["is_new_contract"] = contract["isNewContract"].lower() == "true"
-                            del contract["isNewContract"]
-                        else:
-                            contract["is_new_contract"] = False
-                        
-                        if "dayTimestamp" in contract:
-                            contract["day_timestamp"] = int(contract["dayTimestamp"])
-                            del contract["dayTimestamp"]
-                        else:
-                            # Approximate day timestamp from block number if not available
-                            block_timestamp = contract["last_interaction_block"] * 12  # ~12 seconds per block
-                            contract["day_timestamp"] = (block_timestamp // 86400) * 86400
-                    
-                    # Add to all contracts
-                    all_contracts.extend(contracts)
-                    
-                    # Save batch data
-                    os.makedirs("output/batches", exist_ok=True)
-                    with open(f"output/batches/contracts_batch{batch+1}.json", "w") as f:
-                        json.dump(contracts, f, indent=2)
-                    
-                    print(f"Saved batch {batch+1} data to output/batches/contracts_batch{batch+1}.json")
-                else:
-                    print(f"No contracts found in output for batch {batch+1}")
+                print(f"Saved batch {batch+1} data to output/batches/contracts_batch{batch+1}.json")
             else:
-                print(f"No output from Substreams for batch {batch+1}")
-                if result.stderr:
-                    print(f"Error output: {result.stderr}")
+                print(f"No contracts found in output for batch {batch+1}")
         except Exception as e:
             print(f"Error processing batch {batch+1}: {e}")
             print("Continuing with next batch...")
     
-    print(f"\nAll batches processed. Total contracts: {len(all_contracts)}")
+    print(f"\nAll batches processed. Total contracts: {total_records}")
     return all_contracts
 
 # Get real data from Substreams with a batched approach
 # Use a 3-month (90-day) timeframe processed in smaller batches (1 day each)
-contracts = process_in_batches(total_days=90, batch_size=1, start_block=22000000)
-print(f"Retrieved {len(contracts)} contracts from all batches")
-
-# Ensure we have data
-if not contracts:
-    raise RuntimeError("No contract data retrieved from Substreams")
+# With --memory-mb (or AGGREGATION_MEMORY_MB) records are aggregated per contract
+# and day within that memory budget, spilling to disk, instead of being kept in memory
+parser = argparse.ArgumentParser(description="Collect and analyze 90 days of contract usage in daily batches")
+parser.add_argument("--memory-mb", type=int, default=int(os.environ.get("AGGREGATION_MEMORY_MB", "0")),
+                    help="Aggregate within this memory budget, spilling to disk; 0 keeps every record in memory (default: %(default)s)")
+args = parser.parse_args()
+memory_budget_mb = args.memory_mb
+daily_stats = None
+zone_map = None
 
-# Save to output file
-with open("output/contracts.json", "w") as f:
-    json.dump(contracts, f, indent=2)
+if memory_budget_mb:
+    aggregator = ExternalAggregator(memory_budget=memory_budget_mb * 1024 * 1024)
+    process_in_batches(total_days=90, batch_size=1, start_block=22000000, aggregator=aggregator)
+    
+    # output/contracts.json holds one record per contract and day, the analysis
+    # below works on the per-contract totals
+    # The snapshot's zone map is built while the aggregates are written, not by reading them back
+    zone_map = ZoneMapBuilder()
+    contracts, daily_stats = aggregator.write_results("output/contracts.json", zone_map)
+    print(f"Retrieved {len(contracts)} contracts from all batches")
+    
+    if not contracts:
+        raise RuntimeError("No contract data retrieved from Substreams")
+else:
+    contracts = process_in_batches(total_days=90, batch_size=1, start_block=22000000)
+    print(f"Retrieved {len(contracts)} contracts from all batches")
+    
+    # Ensure we have data
+    if not contracts:
+        raise RuntimeError("No contract data retrieved from Substreams")
+    
+    # Save to output file
+    with open("output/contracts.json", "w") as f:
+        json.dump(contracts, f, indent=2)
 
 print(f"Saved contract data to output/contracts.json")
 
@@ -492,13 +330,22 @@ print(f"Saved contract data to output/contracts.json")
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 result_file = f"results/contracts_{timestamp}.json"
 
-with open(result_file, "w") as f:
-    json.dump(contracts, f, indent=2)
+shutil.copyfile("output/contracts.json", result_file)
 
 print(f"Created timestamped copy at {result_file}")
 
+# Index the batches and the snapshot so lookups can skip partitions that cannot match
+if zone_map is not None:
+    save_zone_map(result_file, zone_map.build(result_file))
+else:
+    index_partition(result_file, contracts)
+build_catalog()
+
 # Analyze the contract data
 analysis = analyze_contracts(contracts)
+if daily_stats is not None:
+    # Per-contract totals span many days, use the per-day aggregates instead
+    analysis["daily_stats"] = daily_stats
 
 # Save analysis to a separate file
 analysis_file = f"results/analysis_{timestamp}.json"
@@ -509,6 +356,9 @@ with open(analysis_file, "w") as f:
 with open("results/latest_analysis.json", "w") as f:
     json.dump(analysis, f, indent=2)
 
+# Report what changed since the previous snapshot
+publish_latest_diff(timestamp, {"contracts": contracts, "analysis": analysis})
+
 print(f"Analysis complete! Found {analysis['total_contracts_analyzed']} contracts.")
 print(f"Most active contract: {analysis['most_active_contracts'][0]['address']} with {analysis['most_active_contracts'][0]['total_calls']} calls")
 print(f"Most popular contract: {analysis['most_popular_contracts'][0]['address']} with {analysis['most_popular_contracts'][0]['unique_wallets']} unique wallets")
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Distributed backfills for the Substreams Contract Reviewer.
+
+A backfill is split into fixed block ranges recorded in a SQLite file on
+storage shared by every host. Workers lease one range at a time, heartbeat
+while Substreams runs, and write their partial result to a shared directory.
+A lease that stops heartbeating expires and is handed to another worker, so
+a dead host only costs the range it was working on. Completed partials are
+merged in block order, which makes the merged output independent of which
+worker finished first.
+
+Usage:
+    python3 range_leases.py plan --start-block 22000000 --stop-block 22648000 --chunk-size 7200
+    python3 range_leases.py work        # on every host, as many times as needed
+    python3 range_leases.py status
+    python3 range_leases.py merge
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from process_contracts import fetch_block_range, publish_results
+from zone_maps import index_partition
+
+LEASE_DB = "output/leases.db"
+PARTIALS_DIR = "output/leases"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    start_block INTEGER PRIMARY KEY,
+    stop_block INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result_path TEXT,
+    error TEXT
+)
+"""
+
+class LeaseCoordinator:
+    """Hands out block-range leases from a shared SQLite file."""
+
+    def __init__(self, db_path=LEASE_DB, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # Autocommit mode so every write transaction is opened explicitly
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _write(self, statement, params):
+        """Run one write statement in an immediate transaction and return the rows changed."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            changed = conn.execute(statement, params).rowcount
+            conn.execute("COMMIT")
+            return changed
+        finally:
+            conn.close()
+
+    def plan(self, start_block, stop_block, chunk_size):
+        """Split [start_block, stop_block) into ranges, keeping any already planned."""
+        ranges = [
+            (block, min(block + chunk_size, stop_block))
+            for block in range(start_block, stop_block, chunk_size)
+        ]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO leases (start_block, stop_block) VALUES (?, ?)",
+                ranges
+            )
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return added
+
+    def acquire(self, worker):
+        """Lease the lowest pending or expired range to a worker, or return None when none is left."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # Take the write lock up front so two workers never pick the same row
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """
+                SELECT * FROM leases
+                WHERE (status = 'pending' OR (status = 'leased' AND expires_at < ?))
+                  AND attempts < ?
+                ORDER BY start_block LIMIT 1
+                """,
+                (now, self.max_attempts)
+            ).fetchone()
+            if row is None:
+                # Ranges that expired too many times are given up on
+                conn.execute(
+                    "UPDATE leases SET status = 'failed' WHERE status = 'leased' AND expires_at < ? AND attempts >= ?",
+                    (now, self.max_attempts)
+                )
+                conn.execute("COMMIT")
+                return None
+            if row["status"] == "leased":
+                print(f"Reassigning blocks {row['start_block']}-{row['stop_block']} from expired worker {row['worker']}")
+            conn.execute(
+                "UPDATE leases SET status = 'leased', worker = ?, expires_at = ?, attempts = attempts + 1, error = NULL WHERE start_block = ?",
+                (worker, now + self.lease_seconds, row["start_block"])
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return {
+            "start_block": row["start_block"],
+            "stop_block": row["stop_block"],
+            "worker": worker,
+            "attempt": row["attempts"] + 1
+        }
+
+    def _owner_clause(self):
+        return "start_block = ? AND status = 'leased' AND worker = ? AND attempts = ?"
+
+    def _owner_params(self, lease):
+        return (lease["start_block"], lease["worker"], lease["attempt"])
+
+    def heartbeat(self, lease):
+        """Extend a lease, returning False once it has been lost to another worker."""
+        return self._write(
+            f"UPDATE leases SET expires_at = ? WHERE {self._owner_clause()}",
+            (time.time() + self.lease_seconds,) + self._owner_params(lease)
+        ) == 1
+
+    def complete(self, lease, result_path):
+        """Mark a leased range as done, returning False if the lease was lost meanwhile."""
+        return self._write(
+            f"UPDATE leases SET status = 'done', result_path = ?, expires_at = NULL WHERE {self._owner_clause()}",
+            (result_path,) + self._owner_params(lease)
+        ) == 1
+
+    def release(self, lease, error):
+        """Give a range back after a failed attempt so another worker can retry it."""
+        return self._write(
+            f"UPDATE leases SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            f"worker = NULL, expires_at = NULL, error = ? WHERE {self._owner_clause()}",
+            (self.max_attempts, str(error)) + self._owner_params(lease)
+        ) == 1
+
+    def status(self):
+        """Count ranges by status."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) AS ranges FROM leases GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        return {row["status"]: row["ranges"] for row in rows}
+
+    def completed(self):
+        """Return the finished ranges in block order."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM leases WHERE status = 'done' ORDER BY start_block").fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+def default_fetch(start_block, stop_block):
+    """Run Substreams for one leased range."""
+    return fetch_block_range(start_block, stop_block - start_block)
+
+def write_partial(contracts, partials_dir, lease):
+    """Atomically write one range's contracts and return the file path."""
+    os.makedirs(partials_dir, exist_ok=True)
+    path = os.path.join(partials_dir, f"contracts_{lease['start_block']}_{lease['stop_block']}.json")
+    tmp_path = f"{path}.{lease['worker']}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(contracts, f)
+    os.replace(tmp_path, path)
+    index_partition(path, contracts)
+    return path
+
+def run_worker(coordinator, worker=None, partials_dir=PARTIALS_DIR, fetch=default_fetch):
+    """Process leased ranges until none are left, returning how many this worker completed."""
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    completed = 0
+
+    while True:
+        lease = coordinator.acquire(worker)
+        if lease is None:
+            # Ranges held by other workers may still expire and need a new owner
+            if coordinator.status().get("leased"):
+                time.sleep(min(coordinator.lease_seconds / 3, 10))
+                continue
+            break
+        print(f"[{worker}] Processing blocks {lease['start_block']}-{lease['stop_block']} (attempt {lease['attempt']})")
+
+        # Keep the lease alive while Substreams runs
+        lost = threading.Event()
+        stop = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(coordinator.lease_seconds / 3):
+                if not coordinator.heartbeat(lease):
+                    lost.set()
+                    return
+
+        heartbeat = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat.start()
+        try:
+            contracts = fetch(lease["start_block"], lease["stop_block"])
+        except Exception as e:
+            stop.set()
+            heartbeat.join()
+            print(f"[{worker}] Error processing blocks {lease['start_block']}-{lease['stop_block']}: {e}")
+            coordinator.release(lease, e)
+            continue
+        stop.set()
+        heartbeat.join()
+
+        if lost.is_set():
+            print(f"[{worker}] Lease on blocks {lease['start_block']}-{lease['stop_block']} expired, discarding result")
+            continue
+
+        # Partials of the same range are identical, so a late duplicate write is harmless
+        path = write_partial(contracts, partials_dir, lease)
+        if coordinator.complete(lease, path):
+            completed += 1
+            print(f"[{worker}] Saved {len(contracts)} contracts to {path}")
+        else:
+            print(f"[{worker}] Lease on blocks {lease['start_block']}-{lease['stop_block']} expired before completion")
+
+    print(f"[{worker}] No ranges left, completed {completed}")
+    return completed
+
+def merge_partials(coordinator):
+    """Concatenate completed partials in block order."""
+    status = coordinator.status()
+    unfinished = sum(count for state, count in status.items() if state != "done")
+    if unfinished:
+        print(f"Warning: {unfinished} ranges are not done yet ({status})")
+
+    all_contracts = []
+    for lease in coordinator.completed():
+        with open(lease["result_path"]) as f:
+            all_contracts.extend(json.load(f))
+    return all_contracts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a Substreams backfill across hosts with block-range leases")
+    parser.add_argument("--db", default=LEASE_DB, help="Shared lease database (default: %(default)s)")
+    parser.add_argument("--partials-dir", default=PARTIALS_DIR, help="Shared directory for partial results (default: %(default)s)")
+    parser.add_argument("--lease-seconds", type=int, default=LEASE_SECONDS, help="Lease lifetime without a heartbeat (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="Record the block ranges of a backfill")
+    plan_parser.add_argument("--start-block", type=int, required=True)
+    plan_parser.add_argument("--stop-block", type=int, required=True)
+    plan_parser.add_argument("--chunk-size", type=int, default=7200, help="Blocks per lease, ~1 day (default: %(default)s)")
+
+    work_parser = subparsers.add_parser("work", help="Process ranges until none are left")
+    work_parser.add_argument("--worker", help="Worker name (default: <hostname>-<pid>)")
+
+    subparsers.add_parser("status", help="Show how many ranges are in each state")
+    subparsers.add_parser("merge", help="Merge completed partials and publish the analysis")
+
+    args = parser.parse_args()
+    coordinator = LeaseCoordinator(args.db, lease_seconds=args.lease_seconds)
+
+    if args.command == "plan":
+        added = coordinator.plan(args.start_block, args.stop_block, args.chunk_size)
+        print(f"Planned {added} new ranges")
+    elif args.command == "work":
+        run_worker(coordinator, args.worker, args.partials_dir)
+    elif args.command == "status":
+        print(json.dumps(coordinator.status(), indent=2))
+    elif args.command == "merge":
+        contracts = merge_partials(coordinator)
+        print(f"Merged {len(contracts)} contracts from completed ranges")
+        if not contracts:
+            raise RuntimeError("No contract data in completed ranges")
+        publish_results(contracts)
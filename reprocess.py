@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Offline reprocessing for the Substreams Contract Reviewer.
+Rebuilds the contract data and analysis from the raw Substreams output
+archived in output/raw/ instead of querying the Substreams endpoint again.
+
+Raw files are memory-mapped and scanned with byte-level regular expressions,
+so only one block's contract records at a time are turned into Python
+objects. They are only used once their contracts array is closed, so a
+document cut off when a stalled run was killed contributes nothing.
+
+Records are streamed into a spill-to-disk aggregator per (address, day), so
+memory stays within the aggregation budget however much output is archived.
+"""
+
+import argparse
+import glob
+import json
+import mmap
+import os
+import re
+
+from external_aggregation import ExternalAggregator, summarize_aggregates
+from process_contracts import analyze_contracts, publish_results
+from substreams_output import normalize_contract
+from watchlist import check_unique_names, load_watchlist
+
+RAW_DIR = "output/raw"
+WATCHLIST_OUTPUT_DIR = "output/watchlists"
+WATCHLIST_RESULTS_DIR = "results/watchlists"
+MEMORY_BUDGET_MB = 256
+
+# Start of a ContractUsages array, e.g. `"contracts": [`
+CONTRACTS_ARRAY = re.compile(rb'"contracts"\s*:\s*\[')
+
+# One contract record followed by its separator. Records are flat objects
+# (interactingWallets only holds address strings), so they never nest braces.
+CONTRACT_RECORD = re.compile(rb'\s*(\{[^{}]*\})\s*([,\]])')
+
+EMPTY_ARRAY_END = re.compile(rb'\s*\]')
+
+def batch_number(path):
+    """Return the batch number of a raw output file, used to keep batch order."""
+    match = re.search(r"batch(\d+)", os.path.basename(path))
+    return int(match.group(1)) if match else 0
+
+def find_raw_files(raw_dir=RAW_DIR):
+    """List archived raw output files in batch order."""
+    paths = glob.glob(os.path.join(raw_dir, "*.txt"))
+    return sorted(paths, key=lambda path: (batch_number(path), path))
+
+def iter_raw_records(path):
+    """Yield the raw contract records of every complete contracts array in one archived output file."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            while True:
+                array_start = CONTRACTS_ARRAY.search(mm, pos)
+                if not array_start:
+                    break
+                pos = array_start.end()
+
+                empty = EMPTY_ARRAY_END.match(mm, pos)
+                if empty:
+                    pos = empty.end()
+                    continue
+
+                # Walk the array record by record until its closing bracket
+                records = []
+                while True:
+                    record = CONTRACT_RECORD.match(mm, pos)
+                    if not record:
+                        # Truncated or malformed array, drop it and resync on the next one
+                        records = []
+                        break
+                    pos = record.end()
+                    try:
+                        records.append(json.loads(record.group(1)))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping malformed record at byte {record.start(1)} of {path}: {e}")
+                    if record.group(2) == b"]":
+                        break
+                yield from records
+
+def iter_raw_contracts(paths):
+    """Yield every normalized contract record from the given raw output files."""
+    for path in paths:
+        count = 0
+        for record in iter_raw_records(path):
+            count += 1
+            yield normalize_contract(record)
+        print(f"Extracted {count} contracts from {path}")
+
+def summarize(aggregator, contracts_path=None):
+    """Return the per-address and per-day totals of an aggregator, optionally saving its aggregates."""
+    if contracts_path:
+        return aggregator.write_results(contracts_path)
+    try:
+        return summarize_aggregates(aggregator.iter_aggregates())
+    finally:
+        aggregator.close()
+
+def publish_watchlist_slices(contracts, watchlists, memory_budget_mb=MEMORY_BUDGET_MB):
+    """Re-slice one stream of records against several watch-lists and analyze each slice."""
+    check_unique_names(watchlists)
+    os.makedirs(WATCHLIST_OUTPUT_DIR, exist_ok=True)
+    os.makedirs(WATCHLIST_RESULTS_DIR, exist_ok=True)
+
+    # The budget is shared by the slices
+    budget = memory_budget_mb * 1024 * 1024 // len(watchlists)
+    aggregators = {watchlist.name: ExternalAggregator(memory_budget=budget) for watchlist in watchlists}
+    try:
+        for contract in contracts:
+            for watchlist in watchlists:
+                if contract.get("address", "") in watchlist:
+                    aggregators[watchlist.name].add(contract)
+    except BaseException:
+        for aggregator in aggregators.values():
+            aggregator.close()
+        raise
+
+    analyses = {}
+    for name, aggregator in aggregators.items():
+        # The slice file holds one record per contract and day
+        sliced, daily_stats = summarize(aggregator, os.path.join(WATCHLIST_OUTPUT_DIR, f"{name}.json"))
+        analysis = analyze_contracts(sliced)
+        analysis["daily_stats"] = daily_stats
+        with open(os.path.join(WATCHLIST_RESULTS_DIR, f"{name}_analysis.json"), "w") as f:
+            json.dump(analysis, f, indent=2)
+
+        print(f"Watch-list {name}: {len(sliced)} contracts")
+        analyses[name] = analysis
+    return analyses
+
+def reprocess(raw_dir=RAW_DIR, watchlists=(), memory_budget_mb=MEMORY_BUDGET_MB):
+    """Rebuild contract data and analysis from archived raw output."""
+    paths = find_raw_files(raw_dir)
+    if not paths:
+        raise RuntimeError(f"No raw Substreams output found in {raw_dir}")
+
+    print(f"Reprocessing {len(paths)} raw output files from {raw_dir}")
+    contracts = iter_raw_contracts(paths)
+
+    if len(watchlists) > 1:
+        return publish_watchlist_slices(contracts, watchlists, memory_budget_mb)
+
+    aggregator = ExternalAggregator(memory_budget=memory_budget_mb * 1024 * 1024)
+    try:
+        for contract in contracts:
+            if not watchlists or contract.get("address", "") in watchlists[0]:
+                aggregator.add(contract)
+    except BaseException:
+        aggregator.close()
+        raise
+    records = aggregator.records
+    contracts, daily_stats = summarize(aggregator)
+    if watchlists:
+        print(f"Kept {records} records on watch-list {watchlists[0].name}")
+    print(f"Retrieved {len(contracts)} contracts from {records} archived records")
+
+    if not contracts:
+        raise RuntimeError("No contract data found in archived Substreams output")
+
+    # Totals per contract, with the per-day totals taken from the aggregates
+    return publish_results(contracts, daily_stats=daily_stats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild analysis from archived raw Substreams output")
+    parser.add_argument("--raw-dir", default=RAW_DIR, help="Directory holding raw batch output (default: %(default)s)")
+    parser.add_argument("--watchlist", action="append", default=[],
+                        help="Watch-list file to filter by; repeat to slice the same data against several lists")
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_BUDGET_MB,
+                        help="Memory budget for aggregation before spilling to disk (default: %(default)s)")
+    args = parser.parse_args()
+
+    watchlists = [load_watchlist(path) for path in args.watchlist]
+    try:
+        check_unique_names(watchlists)
+    except ValueError as e:
+        parser.error(str(e))
+    reprocess(args.raw_dir, watchlists, args.memory_mb)
+    print("Reprocessing complete!")
@@ -79,8 +79,22 @@ fi
 
 # Sync to Hetzner Storage Box using rclone
 echo "Syncing data to Hetzner Storage Box (IPv4 only)..."
-# The --ipv4 flag forces rclone to use IPv4 only
-rclone copy --ipv4 ./output hetzner:substreams-data
+# Only transfer files whose hash differs from the remote manifest
+REMOTE_MANIFEST=$(mktemp)
+CHANGED_FILES=$(mktemp)
+rclone cat --ipv4 hetzner:substreams-data/manifest.json > "$REMOTE_MANIFEST" 2>/dev/null || : > "$REMOTE_MANIFEST"
+python3 artifact_sync.py changed --root ./output --remote-manifest "$REMOTE_MANIFEST" > "$CHANGED_FILES"
+echo "$(wc -l < "$CHANGED_FILES") changed files to upload"
+
+if [ -s "$CHANGED_FILES" ]; then
+  # The --ipv4 flag forces rclone to use IPv4 only
+  rclone copy --ipv4 --transfers 8 --files-from "$CHANGED_FILES" ./output hetzner:substreams-data
+  # The storage box cannot hash remotely, so verify by downloading the new files
+  rclone check --ipv4 --download --one-way --files-from "$CHANGED_FILES" ./output hetzner:substreams-data || exit 1
+fi
+# Upload the manifest last so an interrupted sync is retried next run
+rclone copyto --ipv4 ./output/manifest.json hetzner:substreams-data/manifest.json
+rm -f "$REMOTE_MANIFEST" "$CHANGED_FILES"
 echo "Sync complete!"
 
 echo "Completed processing up to block $CURRENT_BLOCK"
@@ -15,11 +15,10 @@ if ! command -v jq &> /dev/null; then
   exit 1
 fi
 
-# Check if AWS CLI is installed
-if ! command -v aws &> /dev/null; then
-  echo "Error: AWS CLI is not installed. Please install it first:"
-  echo "  macOS: brew install awscli"
-  echo "  Linux: pip install awscli"
+# Check if boto3 is installed
+if ! python3 -c "import boto3" &> /dev/null; then
+  echo "Error: boto3 is not installed. Please install it first:"
+  echo "  pip install boto3"
   exit 1
 fi
 
@@ -51,18 +50,16 @@ EOF
 fi
 
 # Upload to Hetzner Object Storage (S3)
-echo "Uploading data to Hetzner Object Storage (IPv4 only)..."
-# Force IPv4 connection
-aws s3 cp ./output/contracts.json s3://${HETZNER_BUCKET_NAME:-your-bucket-name}/ \
+echo "Uploading changed data to Hetzner Object Storage (IPv4 only)..."
+# Only the published contract data is sent, and only if its hash differs from the bucket's manifest
+python3 artifact_sync.py push \
+  --root ./output \
+  --include contracts.json \
+  --s3-bucket ${HETZNER_BUCKET_NAME:-your-bucket-name} \
   --endpoint-url http://5.161.70.165:9000 \
   --profile hetzner \
-  --cli-connect-timeout 10 \
   --region us-east-1 \
-  --no-verify-ssl \
-  --cli-read-timeout 20 \
-  --cli-connect-timeout 10 \
-  --metadata-directive REPLACE \
-  --cache-control "max-age=86400"
+  --workers 8 || exit 1
 
 echo "Upload complete!"
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Multi-process test of the block-range leases in range_leases.py.
+
+Several local worker processes share one lease database with short leases.
+Some ranges fail on their first attempt, one range is slower than the lease
+lifetime (the heartbeat must keep it), and one worker dies while holding a
+lease (the lease must expire and be reassigned). Every range has to end up
+done exactly once, and the merged output must be in block order.
+
+Run with `python3 scripts/testing/test_range_leases.py` or pytest.
+"""
+
+import functools
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from range_leases import LeaseCoordinator, merge_partials, run_worker
+
+START_BLOCK = 22000000
+CHUNK_SIZE = 100
+RANGES = 20
+LEASE_SECONDS = 2
+WORKERS = 4
+
+FLAKY_RANGES = {START_BLOCK + CHUNK_SIZE * index for index in (1, 5, 9)}
+SLOW_RANGE = START_BLOCK + CHUNK_SIZE * 3
+
+def flaky_fetch(marker_dir, start_block, stop_block):
+    """Stand-in for Substreams: fails the first attempt of some ranges and is slow on one."""
+    if start_block in FLAKY_RANGES:
+        try:
+            # Only the first worker to get here creates the marker and fails
+            os.close(os.open(os.path.join(marker_dir, f"failed_{start_block}"), os.O_CREAT | os.O_EXCL))
+            raise RuntimeError(f"simulated failure for blocks {start_block}-{stop_block}")
+        except FileExistsError:
+            pass
+    if start_block == SLOW_RANGE:
+        time.sleep(LEASE_SECONDS * 1.5)
+    time.sleep(0.05)
+    return [{"address": f"0x{start_block:040x}", "first_interaction_block": start_block, "last_interaction_block": stop_block - 1}]
+
+def worker_process(db_path, partials_dir, marker_dir, name):
+    coordinator = LeaseCoordinator(db_path, lease_seconds=LEASE_SECONDS)
+    run_worker(coordinator, name, partials_dir, functools.partial(flaky_fetch, marker_dir))
+
+def dying_worker(db_path):
+    """Take a lease and exit without completing or releasing it."""
+    coordinator = LeaseCoordinator(db_path, lease_seconds=LEASE_SECONDS)
+    coordinator.acquire("dying-worker")
+    os._exit(1)
+
+def test_workers_share_backfill():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "leases.db")
+        partials_dir = os.path.join(tmp, "partials")
+        coordinator = LeaseCoordinator(db_path, lease_seconds=LEASE_SECONDS)
+        assert coordinator.plan(START_BLOCK, START_BLOCK + CHUNK_SIZE * RANGES, CHUNK_SIZE) == RANGES
+
+        # The dying worker grabs the lowest range before anyone else starts
+        dying = multiprocessing.Process(target=dying_worker, args=(db_path,))
+        dying.start()
+        dying.join()
+
+        workers = [
+            multiprocessing.Process(target=worker_process, args=(db_path, partials_dir, tmp, f"worker-{index}"))
+            for index in range(WORKERS)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=120)
+            assert worker.exitcode == 0
+
+        assert coordinator.status() == {"done": RANGES}
+
+        conn = sqlite3.connect(db_path)
+        try:
+            attempts = dict(conn.execute("SELECT start_block, attempts FROM leases").fetchall())
+            workers_used = {row[0] for row in conn.execute("SELECT worker FROM leases")}
+        finally:
+            conn.close()
+        # Expired lease of the dead worker and failed first attempts were retried
+        assert attempts[START_BLOCK] == 2
+        assert all(attempts[block] == 2 for block in FLAKY_RANGES)
+        # The heartbeat kept the slow range's lease alive
+        assert attempts[SLOW_RANGE] == 1
+        assert "dying-worker" not in workers_used
+
+        merged = merge_partials(coordinator)
+        assert [record["first_interaction_block"] for record in merged] == [
+            START_BLOCK + CHUNK_SIZE * index for index in range(RANGES)
+        ]
+
+if __name__ == "__main__":
+    test_workers_share_backfill()
+    print("Range lease test passed")
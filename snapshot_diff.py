@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Change report between two analysis snapshots.
+
+Both snapshots are indexed by contract address in dicts, so the join is a
+single pass over each side. The report lists rank moves in every ranking of
+the analysis, entries and exits, the largest total_calls and unique_wallets
+changes, and contracts that appeared, disappeared or are new. Snapshots are
+read from loose results files or from the compacted history.
+
+Each publish also saves the new snapshot's per-address totals and rankings
+to results/latest_totals.json, and the next publish diffs against that
+file. The previous snapshot's records are never loaded, which keeps
+aggregating runs within their memory budget.
+
+Usage:
+    python3 snapshot_diff.py                                  # latest snapshot vs the one before
+    python3 snapshot_diff.py 20250301_020000 20250302_020000
+    python3 snapshot_diff.py results/analysis_20250301_020000.json results/analysis_20250302_020000.json
+"""
+
+import argparse
+import heapq
+import json
+import os
+from datetime import datetime
+
+from compact_results import RESULTS_DIR, SNAPSHOT_FILE, list_snapshots, load_snapshot
+
+DIFF_PATH = "results/latest_diff.json"
+TOTALS_PATH = "results/latest_totals.json"
+RANKINGS = ("most_active_contracts", "most_popular_contracts", "most_intensive_contracts", "newest_contracts")
+METRICS = ("total_calls", "unique_wallets")
+TOP_CHANGES = 20
+
+def rank_index(entries):
+    """Map each address to its best (first) 1-based rank in a ranking."""
+    ranks = {}
+    for rank, entry in enumerate(entries, 1):
+        ranks.setdefault(entry["address"].lower(), rank)
+    return ranks
+
+def diff_ranking(old_entries, new_entries):
+    old_ranks = rank_index(old_entries)
+    new_ranks = rank_index(new_entries)
+    return {
+        "entered": [
+            {"address": address, "rank": rank}
+            for address, rank in new_ranks.items() if address not in old_ranks
+        ],
+        "exited": [
+            {"address": address, "old_rank": rank}
+            for address, rank in old_ranks.items() if address not in new_ranks
+        ],
+        "moved": [
+            {"address": address, "old_rank": old_ranks[address], "new_rank": rank, "change": old_ranks[address] - rank}
+            for address, rank in new_ranks.items() if address in old_ranks and old_ranks[address] != rank
+        ]
+    }
+
+def contract_totals(snapshot):
+    """Index a snapshot's per-address totals.
+
+    Records of the same contract (one per block range or day) are summed. A
+    snapshot without its contract file falls back to the contracts listed in
+    its rankings. Totals saved with the snapshot are used as they are.
+    """
+    if snapshot.get("totals") is not None:
+        return snapshot["totals"]
+    totals = {}
+    records = snapshot.get("contracts")
+    if not records:
+        seen = set()
+        records = []
+        for name in RANKINGS:
+            for entry in (snapshot.get("analysis") or {}).get(name, []):
+                # The rankings repeat the same record, count it once
+                if entry["address"].lower() not in seen:
+                    seen.add(entry["address"].lower())
+                    records.append(entry)
+
+    for record in records:
+        address = record["address"].lower()
+        total = totals.get(address)
+        if total is None:
+            total = totals[address] = {metric: 0 for metric in METRICS}
+            total["is_new_contract"] = False
+        for metric in METRICS:
+            total[metric] += record.get(metric, 0)
+        total["is_new_contract"] = total["is_new_contract"] or record.get("is_new_contract", False)
+    return totals
+
+def diff_snapshots(old, new, old_label=None, new_label=None, top=TOP_CHANGES):
+    """Compare two snapshots ({"contracts": [...], "analysis": {...}}) and return the change report."""
+    old_totals = contract_totals(old)
+    new_totals = contract_totals(new)
+    appeared = [address for address in new_totals if address not in old_totals]
+    disappeared = [address for address in old_totals if address not in new_totals]
+    new_contracts = [address for address in appeared if new_totals[address]["is_new_contract"]]
+
+    def by_calls(addresses, totals):
+        largest = heapq.nlargest(top, addresses, key=lambda address: totals[address]["total_calls"])
+        return [{"address": address, **{metric: totals[address][metric] for metric in METRICS}} for address in largest]
+
+    metric_changes = {}
+    for metric in METRICS:
+        deltas = (
+            (new_totals[address][metric] - old_totals[address][metric], address)
+            for address in new_totals if address in old_totals
+        )
+        largest = heapq.nlargest(top, (item for item in deltas if item[0]), key=lambda item: abs(item[0]))
+        metric_changes[metric] = [
+            {"address": address, "old": old_totals[address][metric], "new": new_totals[address][metric], "change": delta}
+            for delta, address in largest
+        ]
+
+    old_analysis = old.get("analysis") or {}
+    new_analysis = new.get("analysis") or {}
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "old_snapshot": old_label,
+        "new_snapshot": new_label,
+        "summary": {
+            "contracts_before": len(old_totals),
+            "contracts_after": len(new_totals),
+            "appeared": len(appeared),
+            "disappeared": len(disappeared),
+            "newly_deployed": len(new_contracts)
+        },
+        "rankings": {
+            name: diff_ranking(old_analysis.get(name, []), new_analysis.get(name, []))
+            for name in RANKINGS if name in old_analysis and name in new_analysis
+        },
+        "metric_changes": metric_changes,
+        "appeared": by_calls(appeared, new_totals),
+        "disappeared": by_calls(disappeared, old_totals),
+        "newly_deployed": by_calls(new_contracts, new_totals)
+    }
+
+def load_side(spec, results_dir=RESULTS_DIR):
+    """Load a snapshot given its timestamp or the path of its analysis or contracts file."""
+    if not os.path.exists(spec):
+        return load_snapshot(spec, results_dir)
+    match = SNAPSHOT_FILE.match(os.path.basename(spec))
+    if match:
+        # Pick up the other half of the snapshot from next to the file
+        return load_snapshot(match.group(2), os.path.dirname(spec) or ".")
+    with open(spec) as f:
+        data = json.load(f)
+    return {"contracts": data, "analysis": None} if isinstance(data, list) else {"contracts": [], "analysis": data}
+
+def previous_snapshot(before, results_dir=RESULTS_DIR):
+    """Return the timestamp and contents of the latest analysed snapshot older than before."""
+    # Listing comes from file names and segment indexes; only the chosen snapshot is read
+    for timestamp in reversed(list_snapshots(results_dir, analysed=True)):
+        if before is None or timestamp < before:
+            return timestamp, load_snapshot(timestamp, results_dir)
+    return None, None
+
+def write_diff(report, output_path=DIFF_PATH):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, output_path)
+    summary = report["summary"]
+    print(f"Saved diff of {report['old_snapshot']} -> {report['new_snapshot']} to {output_path}: "
+          f"{summary['appeared']} appeared, {summary['disappeared']} disappeared, {summary['newly_deployed']} newly deployed")
+
+def load_totals(before, totals_path=TOTALS_PATH):
+    """Return the timestamp and totals saved by the last publish, if it is older than before."""
+    if not os.path.exists(totals_path):
+        return None, None
+    with open(totals_path) as f:
+        saved = json.load(f)
+    if saved["timestamp"] >= before:
+        return None, None
+    return saved["timestamp"], {"totals": saved["totals"], "analysis": saved["rankings"]}
+
+def save_totals(timestamp, totals, analysis, totals_path=TOTALS_PATH):
+    """Keep the per-address totals and rankings the next publish diffs against."""
+    saved = {
+        "timestamp": timestamp,
+        "totals": totals,
+        "rankings": {name: analysis[name] for name in RANKINGS if name in analysis}
+    }
+    os.makedirs(os.path.dirname(totals_path) or ".", exist_ok=True)
+    tmp_path = f"{totals_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(saved, f, separators=(",", ":"))
+    os.replace(tmp_path, totals_path)
+
+def publish_latest_diff(timestamp, snapshot, results_dir=RESULTS_DIR, output_path=DIFF_PATH, totals_path=TOTALS_PATH):
+    """Diff a freshly published snapshot against the previous one and save the report."""
+    new = {"totals": contract_totals(snapshot), "analysis": snapshot.get("analysis")}
+    old_timestamp, old = load_totals(timestamp, totals_path)
+    if old is None:
+        # No saved totals yet, e.g. on the first run with them: read the previous snapshot once
+        old_timestamp, old = previous_snapshot(timestamp, results_dir)
+
+    report = None
+    if old is None:
+        print("No earlier snapshot to diff against")
+    else:
+        report = diff_snapshots(old, new, old_timestamp, timestamp)
+        write_diff(report, output_path)
+    if new["analysis"] is not None:
+        save_totals(timestamp, new["totals"], new["analysis"], totals_path)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report what changed between two analysis snapshots")
+    parser.add_argument("snapshots", nargs="*", help="Old and new snapshot, as timestamps or result files (default: the latest two)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="Results directory (default: %(default)s)")
+    parser.add_argument("--output", default=DIFF_PATH, help="Report file (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=TOP_CHANGES, help="Entries per list in the report (default: %(default)s)")
+    args = parser.parse_args()
+
+    if len(args.snapshots) == 2:
+        old_label, new_label = args.snapshots
+        old, new = load_side(old_label, args.results_dir), load_side(new_label, args.results_dir)
+    elif not args.snapshots:
+        new_label, new = previous_snapshot(None, args.results_dir)
+        old_label, old = previous_snapshot(new_label, args.results_dir) if new is not None else (None, None)
+        if old is None:
+            raise SystemExit("Need at least two analysed snapshots to diff")
+    else:
+        parser.error("give both an old and a new snapshot, or none")
+
+    write_diff(diff_snapshots(old, new, old_label, new_label, args.top), args.output)
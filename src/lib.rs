@@ -6,6 +6,16 @@ use std::collections::{HashMap, HashSet};
 const MAX_WALLETS_PER_CONTRACT: usize = 100; // Limit number of wallets stored per contract
 const NEW_CONTRACT_WINDOW: u64 = 1000; // Blocks to consider a contract "new"
 
+// Verified contract addresses (from Etherscan), used when no watch-list parameter is given
+const VERIFIED_CONTRACTS: [&str; 6] = [
+    "dac17f958d2ee523a2206206994597c13d831ec7", // USDT
+    "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48", // USDC
+    "c02aaa39b223fe8d0a0e5c4f27ead9083c756cc2", // WETH
+    "9030a104a49141459f4b419bd6f56e4ba6fcd800", // Known contract
+    "66a9893cc07d91d95644aedd05d03f95e1dba8af", // Known contract
+    "b326ae62522ae2aa4d5a808faa9bbc0c5b9e740f"  // Known contract
+];
+
 // Protobuf message definitions remain unchanged for compatibility
 #[derive(Clone, PartialEq, prost::Message)]
 pub struct ContractUsage {
@@ -85,11 +95,28 @@ fn store_daily_stats(contracts: ContractUsages, store: StoreSetProto<DailyContra
     }
 }
 
+// Parse the watch-list parameter: hex addresses separated by commas or whitespace
+fn parse_watch_list(params: &str) -> HashSet<Vec<u8>> {
+    let mut addresses: HashSet<Vec<u8>> = params
+        .split(|c: char| c == ',' || c.is_whitespace())
+        .filter_map(|addr| hex::decode(addr.trim_start_matches("0x")).ok())
+        .filter(|addr| addr.len() == 20)
+        .collect();
+
+    if addresses.is_empty() {
+        addresses = VERIFIED_CONTRACTS
+            .iter()
+            .filter_map(|addr| hex::decode(addr).ok())
+            .collect();
+    }
+    addresses
+}
+
 // Map function to process block and extract contract usage
 #[substreams::handlers::map]
-fn map_contract_usage(block: Block) -> Result<ContractUsages, Error> {
+fn map_contract_usage(params: String, block: Block) -> Result<ContractUsages, Error> {
     let mut contract_map: HashMap<String, ContractUsage> = HashMap::new();
-    let mut known_contracts: HashSet<String> = HashSet::new();
+    let known_contracts = parse_watch_list(&params);
 
     // Validate and compute daily timestamp
     let timestamp = block.timestamp();
@@ -101,21 +128,6 @@ fn map_contract_usage(block: Block) -> Result<ContractUsages, Error> {
     }
     let day_timestamp = ((seconds / 86400) * 86400) as u64;
 
-    // List of verified contract addresses (from Etherscan)
-    let verified_contracts = [
-        "dac17f958d2ee523a2206206994597c13d831ec7", // USDT
-        "a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48", // USDC
-        "c02aaa39b223fe8d0a0e5c4f27ead9083c756cc2", // WETH
-        "9030a104a49141459f4b419bd6f56e4ba6fcd800", // Known contract
-        "66a9893cc07d91d95644aedd05d03f95e1dba8af", // Known contract
-        "b326ae62522ae2aa4d5a808faa9bbc0c5b9e740f"  // Known contract
-    ];
-    
-    // Add verified contracts to our set
-    for addr in verified_contracts.iter() {
-        known_contracts.insert(format!("0x{}", addr));
-    }
-
     // Process transactions for contract interactions
     for tx in block.transaction_traces {
         // Skip if no 'to' address, failed, or empty
@@ -123,10 +135,9 @@ fn map_contract_usage(block: Block) -> Result<ContractUsages, Error> {
             continue;
         }
 
-        let contract_addr = format!("0x{}", hex::encode(&tx.to));
-
-        // Only process if the address is in our verified contracts list
-        if known_contracts.contains(&contract_addr) {
+        // Only process if the address is on the watch-list
+        if known_contracts.contains(&tx.to) {
+            let contract_addr = format!("0x{}", hex::encode(&tx.to));
             let from_addr = format!("0x{}", hex::encode(&tx.from));
             let current_block = block.number;
 
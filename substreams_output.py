@@ -0,0 +1,220 @@
+"""
+Decoder for the output of `substreams run`.
+
+The CLI prints one JSON document per block, optionally separated by block
+headers, progress lines or log noise. The decoder tracks brace depth and
+string state as chunks arrive, so every character is scanned once however
+the stream is split, and each document is decoded a single time when its
+top-level brace closes. Each block's ContractUsages is yielded as soon as
+its document is complete; a document cut off at the end of the stream is
+dropped.
+"""
+
+import json
+import re
+
+# Give up on a document that never completes after this many characters
+MAX_DOCUMENT_SIZE = 16 * 1024 * 1024
+
+# Characters that change the scanner state outside and inside strings.
+# JSON strings cannot hold a raw newline, so one ends a cut-off document.
+STRUCTURE_CHARS = re.compile(r'[{}\[\]:,"]')
+STRING_CHARS = re.compile(r'["\\\n]')
+
+def normalize_contract(contract):
+    """Convert a raw Substreams contract record to the snake_case schema used by the analysis."""
+    if "firstInteractionBlock" in contract:
+        contract["first_interaction_block"] = int(contract["firstInteractionBlock"])
+        del contract["firstInteractionBlock"]
+
+    if "lastInteractionBlock" in contract:
+        contract["last_interaction_block"] = int(contract["lastInteractionBlock"])
+        del contract["lastInteractionBlock"]
+
+    if "totalCalls" in contract:
+        contract["total_calls"] = int(contract["totalCalls"])
+        del contract["totalCalls"]
+
+    if "uniqueWallets" in contract:
+        contract["unique_wallets"] = int(contract["uniqueWallets"])
+        del contract["uniqueWallets"]
+
+    if "interactingWallets" in contract:
+        contract["interacting_wallets"] = contract["interactingWallets"]
+        del contract["interactingWallets"]
+
+    # Handle new fields
+    if "isNewContract" in contract:
+        # The scraper yields strings, real JSON yields booleans
+        contract["is_new_contract"] = str(contract["isNewContract"]).lower() == "true"
+        del contract["isNewContract"]
+    else:
+        contract.setdefault("is_new_contract", False)
+
+    if "dayTimestamp" in contract:
+        contract["day_timestamp"] = int(contract["dayTimestamp"])
+        del contract["dayTimestamp"]
+    elif "day_timestamp" not in contract:
+        # Approximate day timestamp from block number if not available
+        block_timestamp = contract.get("last_interaction_block", 0) * 12  # ~12 seconds per block
+        contract["day_timestamp"] = (block_timestamp // 86400) * 86400
+
+    # proto3 JSON omits zero-valued fields
+    contract.setdefault("first_interaction_block", 0)
+    contract.setdefault("last_interaction_block", 0)
+    contract.setdefault("total_calls", 0)
+    contract.setdefault("unique_wallets", 0)
+    contract.setdefault("interacting_wallets", [])
+    return contract
+
+def _opens_object(buffer, start):
+    """Tell whether the brace at start opens a JSON object, or None until more input arrives."""
+    rest = buffer[start + 1:start + 64].lstrip()
+    if not rest:
+        return None
+    return rest[0] in '"}'
+
+class _DocumentScanner:
+    """Brace and string state of the document being scanned, kept across chunks."""
+
+    def __init__(self, start):
+        self.start = start
+        self.scan = start + 1
+        self.stack = ["{"]
+        self.in_string = False
+        self.escaped = False
+        self.verified = False
+        self.last_char = "{"
+        self.last_end = start + 1
+
+    def shift(self, offset):
+        self.start -= offset
+        self.scan -= offset
+        self.last_end -= offset
+
+    def advance(self, buffer):
+        """Scan the new input; return "closed", "invalid" or None if the document is still open."""
+        while self.scan < len(buffer):
+            if self.escaped:
+                self.scan += 1
+                self.escaped = False
+            elif self.in_string:
+                match = STRING_CHARS.search(buffer, self.scan)
+                if not match:
+                    self.scan = len(buffer)
+                    break
+                self.scan = match.end()
+                if match.group() == "\\":
+                    self.escaped = True
+                elif match.group() == '"':
+                    self.in_string = False
+                    self.last_char, self.last_end = '"', self.scan
+                else:
+                    return "invalid"
+            else:
+                match = STRUCTURE_CHARS.search(buffer, self.scan)
+                if not match:
+                    self.scan = len(buffer)
+                    break
+                self.scan = match.end()
+                char = match.group()
+                if char == '"':
+                    self.in_string = True
+                    continue
+                if char == "{":
+                    # A nested object only follows a key or sits in an array; anything
+                    # else is the next document after a cut-off one
+                    in_array = self.stack[-1] == "["
+                    if buffer[self.last_end:match.start()].strip() or not (
+                        self.last_char == ":" or (in_array and self.last_char in ",[")
+                    ):
+                        return "invalid"
+                    self.stack.append(char)
+                elif char == "[":
+                    self.stack.append(char)
+                elif char in "}]":
+                    if self.stack.pop() != ("{" if char == "}" else "["):
+                        return "invalid"
+                    if not self.stack:
+                        return "closed"
+                self.last_char, self.last_end = char, self.scan
+        return None
+
+def iter_json_documents(chunks, max_document_size=MAX_DOCUMENT_SIZE):
+    """Yield every JSON object in a stream of text chunks, skipping any text between them."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    scan = 0
+    document_scanner = None
+
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            if document_scanner is None:
+                start = buffer.find("{", scan)
+                if start == -1:
+                    buffer, scan = "", 0
+                    break
+                document_scanner = _DocumentScanner(start)
+
+            current = document_scanner
+            if not current.verified:
+                current.verified = _opens_object(buffer, current.start)
+                if current.verified is None:
+                    # Only whitespace after the brace so far
+                    buffer = buffer[current.start:]
+                    current.shift(current.start)
+                    break
+
+            state = current.advance(buffer) if current.verified else "invalid"
+            if state is None and current.scan - current.start <= max_document_size:
+                # Keep only the open document until more input arrives
+                buffer = buffer[current.start:]
+                current.shift(current.start)
+                break
+
+            document = None
+            if state == "closed":
+                try:
+                    document, _ = decoder.raw_decode(buffer, current.start)
+                except json.JSONDecodeError:
+                    pass
+            document_scanner = None
+            if document is None:
+                # Noise that merely contains a brace, or a cut-off document
+                scan = current.start + 1
+                continue
+            scan = current.scan
+            if isinstance(document, dict):
+                yield document
+
+    if document_scanner is not None:
+        # The stream ended inside a document; anything complete after its start still counts
+        yield from iter_json_documents([buffer[document_scanner.start + 1:]], max_document_size)
+
+def iter_text_chunks(stream, size=64 * 1024):
+    """Read a text stream in fixed-size chunks."""
+    return iter(lambda: stream.read(size), "")
+
+def document_contracts(document):
+    """Return the raw contract records carried by one output document."""
+    data = document.get("@data", document)
+    if not isinstance(data, dict):
+        return []
+    contracts = data.get("contracts", [])
+    return [contract for contract in contracts if isinstance(contract, dict)]
+
+def iter_block_contracts(chunks):
+    """Yield (block_number, contracts) for every ContractUsages document in the stream."""
+    for document in iter_json_documents(chunks):
+        if "@data" not in document and "contracts" not in document:
+            continue
+        contracts = [normalize_contract(contract) for contract in document_contracts(document)]
+        yield document.get("@block"), contracts
+
+def parse_contracts(text):
+    """Decode all contract records from captured Substreams output."""
+    contracts = []
+    for _, block_contracts in iter_block_contracts([text]):
+        contracts.extend(block_contracts)
+    return contracts
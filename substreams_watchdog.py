@@ -0,0 +1,182 @@
+"""
+Progress-aware watchdog for `substreams run`.
+
+Instead of a fixed timeout per batch, the CLI output is decoded while it
+streams. Every completed block document (and every block number reported on
+stderr) counts as progress. When nothing advances within the stall timeout
+the run is killed and restarted from the block after the last one fully
+received, so a dead connection costs seconds while a slow but healthy run
+is never cut off.
+
+Without a block count the run follows the chain indefinitely, and an
+on_block callback receives each block's contracts as soon as it arrives.
+
+Failed attempts are retried after an exponential backoff, and the raw
+output file is cut back to the last complete document before the retry, so
+it never holds a partial block.
+"""
+
+import collections
+import re
+import subprocess
+import threading
+import time
+
+from substreams_output import document_contracts, iter_json_documents, normalize_contract
+
+STALL_TIMEOUT = 180
+MAX_RESTARTS = 5
+RETRY_BACKOFF = 5
+MAX_RETRY_BACKOFF = 120
+
+# Block numbers in progress or log lines, e.g. "block #22,000,123" or "block: 22000123"
+STDERR_BLOCK = re.compile(r"block\D{0,3}?#?\s*(\d[\d,]*)", re.IGNORECASE)
+
+class _Attempt:
+    """Progress of one CLI process, shared with its reader threads."""
+
+    def __init__(self, on_block=None, raw_end=None):
+        self.lock = threading.Lock()
+        self.on_block = on_block
+        self.raw_end = raw_end
+        self.contracts = []
+        self.last_block = None
+        self.reported_block = None
+        self.last_progress = time.monotonic()
+        self.documents = 0
+        self.stderr_tail = collections.deque(maxlen=20)
+
+    def idle_seconds(self):
+        with self.lock:
+            return time.monotonic() - self.last_progress
+
+def _read_stdout(proc, attempt, raw_file):
+    def lines():
+        for line in iter(proc.stdout.readline, ""):
+            if raw_file is not None:
+                raw_file.write(line)
+            yield line
+
+    for document in iter_json_documents(lines()):
+        contracts = [normalize_contract(contract) for contract in document_contracts(document)]
+        block = document.get("@block")
+        if attempt.on_block is not None and isinstance(block, int):
+            # Handled before recording progress, so a restart never skips an unhandled block
+            try:
+                attempt.on_block(block, contracts, document)
+            except Exception as e:
+                # Stop this attempt; the retry starts again from the unhandled block
+                print(f"Error handling block {block}: {e!r}")
+                proc.kill()
+                return
+            contracts = []
+        with attempt.lock:
+            attempt.contracts.extend(contracts)
+            attempt.documents += 1
+            if raw_file is not None:
+                # Everything written so far belongs to complete documents
+                attempt.raw_end = raw_file.tell()
+            if isinstance(block, int):
+                attempt.last_block = max(block, attempt.last_block or block)
+            attempt.last_progress = time.monotonic()
+
+def _read_stderr(proc, attempt):
+    for line in iter(proc.stderr.readline, ""):
+        attempt.stderr_tail.append(line.rstrip())
+        match = STDERR_BLOCK.search(line)
+        if not match:
+            continue
+        block = int(match.group(1).replace(",", ""))
+        with attempt.lock:
+            if attempt.reported_block is None or block > attempt.reported_block:
+                attempt.reported_block = block
+                attempt.last_progress = time.monotonic()
+
+def _run_attempt(cmd, env, stall_timeout, raw_file, on_block=None):
+    """Run the CLI once, returning its progress and whether it had to be killed."""
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+    except FileNotFoundError as e:
+        raise RuntimeError("Substreams CLI is not installed") from e
+
+    attempt = _Attempt(on_block, raw_file.tell() if raw_file is not None else None)
+    readers = [
+        threading.Thread(target=_read_stdout, args=(proc, attempt, raw_file), daemon=True),
+        threading.Thread(target=_read_stderr, args=(proc, attempt), daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+
+    stalled = False
+    try:
+        while True:
+            try:
+                proc.wait(timeout=1)
+                break
+            except subprocess.TimeoutExpired:
+                if attempt.idle_seconds() > stall_timeout:
+                    stalled = True
+                    break
+    finally:
+        # Never leave the CLI running, also when interrupted
+        proc.kill()
+        proc.wait()
+        for reader in readers:
+            reader.join(timeout=10)
+    return attempt, proc.returncode, stalled
+
+def run_with_watchdog(build_command, start_block, block_count, env=None,
+                      stall_timeout=STALL_TIMEOUT, max_restarts=MAX_RESTARTS, raw_path=None, on_block=None):
+    """Run Substreams over a block range, restarting stalled runs from the last confirmed block.
+
+    build_command(start_block, block_count) returns the CLI arguments for a
+    (sub)range; block_count is None when following the chain head. Returns
+    the decoded contracts of the whole range, or passes each block's
+    contracts to on_block(block, contracts, document) instead; raises
+    RuntimeError after max_restarts consecutive attempts without progress.
+    Failed attempts are retried after a backoff that doubles with each
+    consecutive failure.
+    """
+    stop_block = None if block_count is None else start_block + block_count
+    next_block = start_block
+    contracts = []
+    failures = 0
+    raw_file = open(raw_path, "w") if raw_path else None
+
+    try:
+        while stop_block is None or next_block < stop_block:
+            cmd = build_command(next_block, None if stop_block is None else stop_block - next_block)
+            attempt, returncode, stalled = _run_attempt(cmd, env, stall_timeout, raw_file, on_block)
+            contracts.extend(attempt.contracts)
+            if attempt.last_block is not None:
+                next_block = attempt.last_block + 1
+
+            if not stalled and returncode == 0:
+                break
+
+            if stalled:
+                print(f"No progress for {stall_timeout}s, restarting from block {next_block}")
+            else:
+                print(f"Substreams exited with code {returncode}, restarting from block {next_block}")
+                for line in attempt.stderr_tail:
+                    print(f"  {line}")
+
+            # Only attempts that got nowhere count towards giving up
+            failures = 0 if attempt.documents else failures + 1
+            if failures > max_restarts:
+                raise RuntimeError(
+                    f"Substreams made no progress at block {next_block} after {max_restarts} restarts"
+                )
+            if raw_file is not None:
+                # Drop a document cut off by the kill, the retry sends its block again
+                raw_file.seek(attempt.raw_end)
+                raw_file.truncate()
+
+            delay = min(RETRY_BACKOFF * 2 ** failures, MAX_RETRY_BACKOFF)
+            print(f"Retrying in {delay}s")
+            time.sleep(delay)
+    finally:
+        if raw_file is not None:
+            raw_file.close()
+
+    return contracts
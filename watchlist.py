@@ -0,0 +1,154 @@
+"""
+Contract watch-lists for the Substreams Contract Reviewer.
+
+A watch-list is a file of contract addresses, one per line (`#` starts a
+comment) or a JSON list of addresses or of objects with an "address" key.
+Addresses are held as a sorted array of 20-byte values behind a Bloom
+filter, so thousands of contracts stay compact and most non-watched
+records are rejected without a binary search.
+"""
+
+import base64
+import bisect
+import json
+import math
+import os
+
+ADDRESS_BYTES = 20
+
+# Linux limits a single command-line argument to 128 KiB
+MAX_PARAM_LENGTH = 128 * 1024 - 1
+
+def parse_address(address):
+    """Return the 20 raw bytes of a hex address, or None if it is not one."""
+    if isinstance(address, (bytes, bytearray)):
+        return bytes(address) if len(address) == ADDRESS_BYTES else None
+    address = address.strip().lower()
+    if address.startswith("0x"):
+        address = address[2:]
+    if len(address) != ADDRESS_BYTES * 2:
+        return None
+    try:
+        return bytes.fromhex(address)
+    except ValueError:
+        return None
+
+class BloomFilter:
+    """Bloom filter over addresses.
+
+    Addresses are already uniformly distributed hash outputs, so the bit
+    positions are derived from the address bytes by double hashing instead
+    of hashing them again.
+    """
+
+    def __init__(self, capacity, error_rate=0.01, num_bits=None, num_hashes=None, bits=None):
+        capacity = max(1, capacity)
+        self.num_bits = num_bits or max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = num_hashes or max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_dict(self):
+        """Serialize the filter to a JSON-friendly dict."""
+        return {
+            "num_bits": self.num_bits,
+            "num_hashes": self.num_hashes,
+            "bits": base64.b64encode(bytes(self.bits)).decode("ascii")
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        bits = bytearray(base64.b64decode(data["bits"]))
+        return cls(1, num_bits=data["num_bits"], num_hashes=data["num_hashes"], bits=bits)
+
+class WatchList:
+    """A set of contract addresses with fast membership checks."""
+
+    def __init__(self, addresses, name="watchlist"):
+        self.name = name
+        parsed = (parse_address(address) for address in addresses)
+        self.addresses = sorted({address for address in parsed if address is not None})
+        self.bloom = BloomFilter(len(self.addresses))
+        for address in self.addresses:
+            self.bloom.add(address)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        key = parse_address(address)
+        if key is None or key not in self.bloom:
+            return False
+        index = bisect.bisect_left(self.addresses, key)
+        return index < len(self.addresses) and self.addresses[index] == key
+
+    def to_param(self):
+        """Encode the list as the map_contract_usage module parameter."""
+        if not self.addresses:
+            # An empty parameter makes the module fall back to its built-in list
+            raise ValueError(f"Watch-list {self.name} has no addresses")
+        param = ",".join(address.hex() for address in self.addresses)
+        if len(param) > MAX_PARAM_LENGTH:
+            raise ValueError(
+                f"Watch-list {self.name} has {len(self)} addresses, too many to pass as a Substreams parameter; "
+                "split it into several lists"
+            )
+        return param
+
+def load_watchlist(path, name=None):
+    """Load a watch-list from a text or JSON file."""
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    with open(path) as f:
+        if path.endswith(".json"):
+            entries = json.load(f)
+            addresses = [entry["address"] if isinstance(entry, dict) else entry for entry in entries]
+        else:
+            addresses = []
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    # Allow CSV exports where the address is the first column
+                    addresses.append(line.split(",", 1)[0])
+
+    watchlist = WatchList(addresses, name)
+    if not watchlist:
+        raise ValueError(f"Watch-list {path} contains no valid contract addresses")
+    print(f"Loaded {len(watchlist)} addresses from watch-list {path}")
+    return watchlist
+
+def filter_contracts(contracts, watchlist):
+    """Keep the contract records whose address is on the watch-list."""
+    return [contract for contract in contracts if contract.get("address", "") in watchlist]
+
+def check_unique_names(watchlists):
+    """Reject watch-lists sharing a name, since their slices and output files are keyed by it."""
+    seen = set()
+    for watchlist in watchlists:
+        if watchlist.name in seen:
+            raise ValueError(f"Several watch-lists are named {watchlist.name}; rename the files so each name is unique")
+        seen.add(watchlist.name)
+
+def split_by_watchlists(contracts, watchlists):
+    """Slice one set of contract records against several watch-lists in a single pass."""
+    check_unique_names(watchlists)
+    slices = {watchlist.name: [] for watchlist in watchlists}
+    for contract in contracts:
+        key = parse_address(contract.get("address", ""))
+        if key is None:
+            continue
+        for watchlist in watchlists:
+            if key in watchlist:
+                slices[watchlist.name].append(contract)
+    return slices
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Zone maps over stored contract partitions.
+
+Every partition file (batch outputs, timestamped results, lease partials and
+compacted segments) gets a <file>.zonemap.json sidecar holding its block
+range, day_timestamp range, record count and a Bloom filter of the contract
+addresses it contains. The sidecars are gathered into one catalog, so a
+lookup such as "what did contract X do in blocks A-B" only opens the few
+partitions whose ranges overlap and whose filter may contain the address.
+
+Usage:
+    python3 zone_maps.py build
+    python3 zone_maps.py query 0xdAC17F958D2ee523a2206206994597C13D831ec7 --start-block 22000000 --stop-block 22100000
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+from datetime import datetime
+
+from watchlist import BloomFilter, parse_address
+
+SIDECAR_SUFFIX = ".zonemap.json"
+CATALOG_PATH = "output/catalog.json"
+PARTITION_PATTERNS = (
+    "output/batches/contracts_batch*.json",
+    "output/leases/*.json",
+    "results/contracts_*.json",
+    "results/compacted/*/*.json.gz"
+)
+ERROR_RATE = 0.01
+
+def sidecar_path(path):
+    return f"{path}{SIDECAR_SUFFIX}"
+
+def read_partition(path):
+    """Load the contract records stored in a partition file."""
+    if path.endswith(".gz"):
+        # Compacted segments store each distinct record once
+        with gzip.open(path, "rt") as f:
+            return json.load(f)["records"]
+    with open(path) as f:
+        return json.load(f)
+
+class ZoneMapBuilder:
+    """Summarizes records into a zone map one at a time, e.g. while they are streamed to disk."""
+
+    def __init__(self):
+        self.addresses = set()
+        self.records = 0
+        self.min_block = self.max_block = None
+        self.min_day = self.max_day = None
+
+    def add(self, record):
+        address = parse_address(record.get("address", ""))
+        if address is not None:
+            self.addresses.add(address)
+        self.records += 1
+        first_block = record.get("first_interaction_block", 0)
+        last_block = record.get("last_interaction_block", 0)
+        day = record.get("day_timestamp", 0)
+        self.min_block = first_block if self.min_block is None else min(self.min_block, first_block)
+        self.max_block = last_block if self.max_block is None else max(self.max_block, last_block)
+        self.min_day = day if self.min_day is None else min(self.min_day, day)
+        self.max_day = day if self.max_day is None else max(self.max_day, day)
+
+    def build(self, path):
+        """Return the zone map of the partition file the records were written to."""
+        bloom = BloomFilter(len(self.addresses), ERROR_RATE)
+        for address in self.addresses:
+            bloom.add(address)
+
+        stat = os.stat(path)
+        return {
+            "path": path,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "records": self.records,
+            "addresses": len(self.addresses),
+            "min_block": self.min_block,
+            "max_block": self.max_block,
+            "min_day": self.min_day,
+            "max_day": self.max_day,
+            "bloom": bloom.to_dict()
+        }
+
+def build_zone_map(path, records):
+    """Summarize a partition's records into a zone map."""
+    builder = ZoneMapBuilder()
+    for record in records:
+        builder.add(record)
+    return builder.build(path)
+
+def save_zone_map(path, zone_map):
+    """Write the zone map sidecar of a partition."""
+    tmp_path = f"{sidecar_path(path)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(zone_map, f)
+    os.replace(tmp_path, sidecar_path(path))
+    return zone_map
+
+def index_partition(path, records=None):
+    """Write the zone map sidecar of a partition and return it."""
+    if records is None:
+        records = read_partition(path)
+    return save_zone_map(path, build_zone_map(path, records))
+
+def load_zone_map(path):
+    """Return the sidecar of a partition, rebuilding it if it is missing or stale."""
+    try:
+        with open(sidecar_path(path)) as f:
+            zone_map = json.load(f)
+        stat = os.stat(path)
+        if zone_map["size"] == stat.st_size and zone_map["mtime"] == stat.st_mtime:
+            return zone_map
+    except (OSError, ValueError, KeyError):
+        pass
+    return index_partition(path)
+
+def find_partitions(patterns=PARTITION_PATTERNS):
+    paths = set()
+    for pattern in patterns:
+        paths.update(path for path in glob.glob(pattern) if not path.endswith(SIDECAR_SUFFIX))
+    return sorted(paths)
+
+def build_catalog(patterns=PARTITION_PATTERNS, catalog_path=CATALOG_PATH):
+    """Gather the zone maps of every partition into one catalog file."""
+    partitions = find_partitions(patterns)
+    entries = [load_zone_map(path) for path in partitions]
+
+    # Sidecars left behind by partitions that were compacted or deleted
+    known = {sidecar_path(path) for path in partitions}
+    for pattern in patterns:
+        for orphan in glob.glob(sidecar_path(pattern)):
+            if orphan not in known:
+                os.remove(orphan)
+
+    catalog = {"generated_at": datetime.now().isoformat(), "partitions": entries}
+    os.makedirs(os.path.dirname(catalog_path) or ".", exist_ok=True)
+    tmp_path = f"{catalog_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(catalog, f)
+    os.replace(tmp_path, catalog_path)
+    print(f"Indexed {len(entries)} partitions in {catalog_path}")
+    return catalog
+
+def catalog_is_stale(catalog, catalog_path=CATALOG_PATH, patterns=PARTITION_PATTERNS):
+    """Tell whether partitions were added, removed or re-indexed since the catalog was built."""
+    partitions = find_partitions(patterns)
+    if set(partitions) != {entry["path"] for entry in catalog["partitions"]}:
+        return True
+    built = os.path.getmtime(catalog_path)
+    for path in partitions:
+        sidecar = sidecar_path(path)
+        if os.path.getmtime(path) > built or (os.path.exists(sidecar) and os.path.getmtime(sidecar) > built):
+            return True
+    return False
+
+def load_catalog(catalog_path=CATALOG_PATH):
+    """Return the catalog, rebuilding it when partitions changed since it was built.
+
+    Writers such as lease workers only write sidecars, so lookups see their
+    partitions without a manual rebuild.
+    """
+    if not os.path.exists(catalog_path):
+        return build_catalog(catalog_path=catalog_path)
+    with open(catalog_path) as f:
+        catalog = json.load(f)
+    if catalog_is_stale(catalog, catalog_path):
+        return build_catalog(catalog_path=catalog_path)
+    return catalog
+
+def may_contain(entry, key, start_block=None, stop_block=None):
+    """Tell from a zone map alone whether a partition can hold matching records."""
+    if not entry["records"]:
+        return False
+    if start_block is not None and entry["max_block"] < start_block:
+        return False
+    if stop_block is not None and entry["min_block"] >= stop_block:
+        return False
+    return key in BloomFilter.from_dict(entry["bloom"])
+
+def query(address, start_block=None, stop_block=None, catalog_path=CATALOG_PATH):
+    """Return {partition: records} for one contract in [start_block, stop_block), skipping pruned partitions."""
+    key = parse_address(address)
+    if key is None:
+        raise ValueError(f"Not a contract address: {address}")
+
+    catalog = load_catalog(catalog_path)
+    candidates = [entry["path"] for entry in catalog["partitions"] if may_contain(entry, key, start_block, stop_block)]
+
+    matches = {}
+    for path in candidates:
+        if not os.path.exists(path):
+            print(f"Skipping {path}, it no longer exists; rebuild the catalog")
+            continue
+        records = [
+            record for record in read_partition(path)
+            if parse_address(record.get("address", "")) == key
+            and (start_block is None or record.get("last_interaction_block", 0) >= start_block)
+            and (stop_block is None or record.get("first_interaction_block", 0) < stop_block)
+        ]
+        if records:
+            matches[path] = records
+
+    print(f"Opened {len(candidates)} of {len(catalog['partitions'])} partitions, {len(matches)} had matching records")
+    return matches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Zone-map index over stored contract partitions")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("address", nargs="?", help="Contract address to look up (query)")
+    parser.add_argument("--start-block", type=int, help="First block of the range (query)")
+    parser.add_argument("--stop-block", type=int, help="Block after the end of the range (query)")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="Catalog file (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_catalog(catalog_path=args.catalog)
+    else:
+        if not args.address:
+            parser.error("query needs an address")
+        matches = query(args.address, args.start_block, args.stop_block, args.catalog)
+        print(json.dumps(matches, indent=2))